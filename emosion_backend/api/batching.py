@@ -0,0 +1,94 @@
+import logging
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """
+    Collects single-image inference requests from many request threads and runs them
+    as one batch. A batch is flushed when it reaches max_batch_size or when the oldest
+    request has waited max_wait_ms. predict_fn(batch_tensor) must return one result per
+    row; each caller gets its own row back through a Future.
+    """
+    def __init__(self, predict_fn, max_batch_size=16, max_wait_ms=5.0):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._queue_wait_total = 0.0
+        self._thread = threading.Thread(target=self._run, name="mood-microbatcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, img_tensor):
+        """Queue one (1, C, H, W) or (C, H, W) tensor; returns a Future for its result."""
+        if img_tensor.dim() == 3:
+            img_tensor = img_tensor.unsqueeze(0)
+        future = Future()
+        self._queue.put((img_tensor, future, time.perf_counter()))
+        return future
+
+    def _collect(self):
+        # Block for the first request, then keep taking more until the batch is full or the deadline passes
+        items = [self._queue.get()]
+        deadline = items[0][2] + self.max_wait
+        while len(items) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                items.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def _run(self):
+        while True:
+            # Callers may have cancelled (an async view whose client went away); skip those
+            items = [item for item in self._collect() if item[1].set_running_or_notify_cancel()]
+            if not items:
+                continue
+            started = time.perf_counter()
+            futures = [future for _, future, _ in items]
+            try:
+                results = self.predict_fn(torch.cat([tensor for tensor, _, _ in items]))
+            except Exception as exc:
+                logger.exception("Micro-batch of %d failed", len(items))
+                for future in futures:
+                    self._resolve(future.set_exception, exc)
+                continue
+            for future, result in zip(futures, results):
+                self._resolve(future.set_result, result)
+
+            with self._stats_lock:
+                self._batch_sizes[len(items)] += 1
+                self._queue_wait_total += sum(started - queued for _, _, queued in items)
+
+    @staticmethod
+    def _resolve(setter, value):
+        # One bad Future must not end the thread every later request depends on
+        try:
+            setter(value)
+        except Exception:
+            logger.exception("Could not deliver a micro-batch result")
+
+    def stats(self):
+        """Batch-size histogram and averages since start."""
+        with self._stats_lock:
+            batches = sum(self._batch_sizes.values())
+            items = sum(size * count for size, count in self._batch_sizes.items())
+            return {
+                "batches": batches,
+                "requests": items,
+                "mean_batch_size": items / batches if batches else 0.0,
+                "max_batch_size": max(self._batch_sizes, default=0),
+                "batch_size_histogram": {str(size): count for size, count in sorted(self._batch_sizes.items())},
+                "mean_queue_wait_ms": self._queue_wait_total / items * 1000 if items else 0.0,
+                "queued": self._queue.qsize(),
+            }
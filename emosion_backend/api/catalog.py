@@ -0,0 +1,91 @@
+import logging
+import random
+
+from django.db import DatabaseError, transaction
+
+from .models import PlaylistTrack, Track
+
+logger = logging.getLogger(__name__)
+
+TRACK_URL = "https://open.spotify.com/track/{spotify_id}"
+
+
+def track_fields(track):
+    """Spotify track object -> Track column values."""
+    album = track.get("album") or {}
+    return {
+        "spotify_id": track["id"],
+        "name": track.get("name") or "",
+        "artists": [a.get("name") for a in track.get("artists", []) if a.get("name")],
+        "album": album.get("name") or "",
+        "duration_ms": track.get("duration_ms") or 0,
+        "image_url": (album.get("images") or [{}])[0].get("url"),
+        "preview_url": track.get("preview_url"),
+    }
+
+
+@transaction.atomic
+def sync_playlist(playlist_id, mood, tracks):
+    """
+    Replace the catalog's copy of a playlist with `tracks` (Spotify track objects, in
+    playlist order). Tracks are upserted on spotify_id; returns the number of entries.
+    """
+    rows, seen = [], set()
+    for track in tracks:
+        if not track or not track.get("id") or track["id"] in seen:
+            continue  # local files / removed tracks have no id; playlists may repeat a track
+        seen.add(track["id"])
+        rows.append(Track(**track_fields(track)))
+
+    Track.objects.bulk_create(
+        rows, update_conflicts=True, unique_fields=["spotify_id"],
+        update_fields=["name", "artists", "album", "duration_ms", "image_url", "preview_url"],
+    )
+    ids = dict(Track.objects.filter(spotify_id__in=seen).values_list("spotify_id", "id"))
+
+    PlaylistTrack.objects.filter(playlist_id=playlist_id).delete()
+    PlaylistTrack.objects.bulk_create([
+        PlaylistTrack(playlist_id=playlist_id, mood=mood, track_id=ids[row.spotify_id], position=position)
+        for position, row in enumerate(rows)
+    ])
+    return len(rows)
+
+
+def sample_playlist(playlist_id, count):
+    """
+    Up to `count` random Tracks of a synced playlist (empty if it was never synced).
+    Positions are dense, so this is a COUNT plus one lookup on the (playlist_id, position)
+    index, not an ORDER BY RANDOM() over the table.
+    """
+    entries = PlaylistTrack.objects.filter(playlist_id=playlist_id)
+    total = entries.count()
+    if not total:
+        return []
+    positions = random.sample(range(total), min(count, total))
+    tracks = {e.position: e.track for e in entries.filter(position__in=positions).select_related("track")}
+    return [tracks[p] for p in positions if p in tracks]
+
+
+def sample_or_empty(playlist_id, count):
+    """sample_playlist, or [] when the catalog table is missing or unreachable, so callers fall back to Spotify."""
+    try:
+        return sample_playlist(playlist_id, count)
+    except DatabaseError:
+        logger.exception("Track catalog unavailable; falling back to Spotify")
+        return []
+
+
+def artist_names(track):
+    return track.artists if isinstance(track.artists, list) else [track.artists] if track.artists else []
+
+
+def as_recommendation(track):
+    """Same shape as spotify_reco.recommend_song_for_mood's dicts."""
+    return {
+        "spotify_id": track.spotify_id,
+        "name": track.name,
+        "artist": ", ".join(artist_names(track)),
+        "url": TRACK_URL.format(spotify_id=track.spotify_id),
+        "preview_url": track.preview_url,
+        "album_cover": track.image_url,
+    }
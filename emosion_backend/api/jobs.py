@@ -0,0 +1,150 @@
+import io
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+class JobQueue:
+    """
+    Local background queue for work the response does not have to wait for (storing
+    uploads, canvas images, thumbnails). Jobs run on a thread pool; the status of the
+    last `max_records` jobs is kept for /api/jobs/<id>/. Status lives in this process
+    only, so with several workers a client may have to ask the worker that took the job.
+    """
+    def __init__(self, max_workers=2, max_records=10000):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="media-job")
+        self._lock = threading.Lock()
+        self._records = OrderedDict()
+        self._futures = set()
+        self.max_records = max_records
+
+    def submit(self, kind, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) in the background; returns the job id."""
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._records[job_id] = {"id": job_id, "kind": kind, "status": QUEUED, "submitted_at": time.time()}
+            while len(self._records) > self.max_records:
+                self._records.popitem(last=False)
+        future = self._executor.submit(self._run, job_id, fn, args, kwargs)
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(self._forget)
+        return job_id
+
+    def _run(self, job_id, fn, args, kwargs):
+        self._update(job_id, status=RUNNING)
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            logger.exception("Background job %s failed", job_id)
+            self._update(job_id, status=FAILED, error=str(e), finished_at=time.time())
+        else:
+            self._update(job_id, status=DONE, result=result, finished_at=time.time())
+        finally:
+            close_old_connections()  # jobs may touch the DB from this pool thread
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            record = self._records.get(job_id)
+            if record is not None:
+                record.update(fields)
+
+    def _forget(self, future):
+        with self._lock:
+            self._futures.discard(future)
+
+    def status(self, job_id):
+        """Copy of the job's record, or None if unknown (or already evicted)."""
+        with self._lock:
+            record = self._records.get(job_id)
+            return dict(record) if record is not None else None
+
+    def wait(self, timeout=None):
+        """Block until every job submitted so far has finished (tests, graceful shutdown)."""
+        with self._lock:
+            futures = list(self._futures)
+        wait(futures, timeout=timeout)
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue():
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = JobQueue(max_workers=getattr(settings, "MEDIA_JOB_WORKERS", 2),
+                                  max_records=getattr(settings, "MEDIA_JOB_HISTORY", 10000))
+    return _queue
+
+
+# ===================== Jobs =====================
+
+def thumbnail_name(name):
+    stem = name.rsplit("/", 1)[-1].rsplit(".", 1)[0]
+    return f"thumbnails/{stem}.jpg"
+
+
+# Content-addressed writes are serialized per name (striped, so memory stays bounded)
+_write_locks = [threading.Lock() for _ in range(64)]
+
+
+def save_once(name, make_content):
+    """
+    Write make_content() under exactly `name` unless it is already stored. Two jobs for
+    the same bytes would otherwise both pass exists() and the second save would get a
+    `<name>_XXXXXXX` copy from get_available_name; that copy (possible across worker
+    processes, which do not share the lock) is deleted again.
+    """
+    with _write_locks[hash(name) % len(_write_locks)]:
+        if default_storage.exists(name):
+            return
+        saved = default_storage.save(name, ContentFile(make_content()))
+    if saved != name:
+        default_storage.delete(saved)
+
+
+def store_upload(name, data):
+    """
+    Create an upload's thumbnail and write the upload under its content-addressed name
+    (once). The thumbnail comes first: it decodes the image, so bytes that are not an
+    image fail the job without anything being stored.
+    """
+    from PIL import Image
+
+    def make_thumbnail():
+        size = getattr(settings, "MEDIA_THUMBNAIL_SIZE", 128)
+        img = Image.open(io.BytesIO(data))
+        img.draft("RGB", (size, size))
+        img = img.convert("RGB")
+        img.thumbnail((size, size))
+        buffer = io.BytesIO()
+        img.save(buffer, format="JPEG", quality=85)
+        return buffer.getvalue()
+
+    thumb = thumbnail_name(name)
+    save_once(thumb, make_thumbnail)
+    save_once(name, lambda: data)
+    return {"name": name, "thumbnail": thumb}
+
+
+def store_canvas(post_id, file_name, data):
+    from .models import Post
+
+    post = Post.objects.get(id=post_id)
+    post.canvas_image.save(file_name, ContentFile(data), save=True)
+    return {"name": post.canvas_image.name}
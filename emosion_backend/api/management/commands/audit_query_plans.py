@@ -0,0 +1,69 @@
+import re
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.utils import timezone
+
+from api.models import ListeningHistory, MoodDetection, PlaylistTrack, Post, TrackFavorite
+
+# Plan lines that mean every row of a table is read: SQLite "SCAN <table>" without an
+# index, PostgreSQL "Seq Scan on <table>"
+FULL_SCAN = {
+    "sqlite": re.compile(r"\bSCAN (?!.*\bUSING (?:COVERING )?INDEX\b)"),
+    "postgresql": re.compile(r"\bSeq Scan on\b"),
+}
+
+
+def key_queries(user_id=1, mood="happy"):
+    """(name, queryset) for the queries the app and its analytics depend on."""
+    since = timezone.now() - timedelta(days=30)
+    return [
+        ("moods over time for a user",
+         MoodDetection.objects.filter(user_id=user_id, created_at__gte=since).order_by("created_at")),
+        ("mood trend across users",
+         MoodDetection.objects.filter(mood=mood, created_at__gte=since).order_by("created_at")),
+        ("mood counts for a user",
+         MoodDetection.objects.filter(user_id=user_id).values("mood").annotate(n=Count("id"))),
+        ("recent posts of a user",
+         Post.objects.filter(user_id=user_id).order_by("-created_at")[:20]),
+        ("recent favorites of a user",
+         TrackFavorite.objects.filter(user_id=user_id).order_by("-created_at")[:20]),
+        ("top tracks for a mood",
+         ListeningHistory.objects.filter(mood=mood).order_by("-listen_count")[:10]),
+        ("a user's tracks for a mood",
+         ListeningHistory.objects.filter(user_id=user_id, mood=mood)),
+        ("recently played by a user",
+         ListeningHistory.objects.filter(user_id=user_id).order_by("-last_listened_at")[:20]),
+        ("catalog sample for a playlist",
+         PlaylistTrack.objects.filter(playlist_id="playlist", position__in=[0, 1, 2])),
+    ]
+
+
+class Command(BaseCommand):
+    help = ("Print the query plan (EXPLAIN QUERY PLAN on SQLite) of each key query and fail if any "
+            "of them reads a whole table.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--verbose-plans", action="store_true", help="print every plan, not only failures")
+
+    def handle(self, *args, **options):
+        pattern = FULL_SCAN.get(connection.vendor)
+        if pattern is None:
+            raise CommandError(f"No full-scan rule for the {connection.vendor} backend")
+
+        failures = []
+        for name, queryset in key_queries():
+            plan = queryset.explain()
+            scans = [line.strip() for line in plan.splitlines() if pattern.search(line)]
+            status = "FULL SCAN" if scans else "ok"
+            self.stdout.write(f"{status:<10} {name}")
+            if scans or options["verbose_plans"]:
+                for line in plan.splitlines():
+                    self.stdout.write(f"           {line}")
+            if scans:
+                failures.append(name)
+        if failures:
+            raise CommandError(f"{len(failures)} key quer{'y' if len(failures) == 1 else 'ies'} "
+                               f"scan a whole table: {', '.join(failures)}")
@@ -0,0 +1,45 @@
+import json
+
+import torch
+from django.core.management.base import BaseCommand
+
+from api import mood_model
+
+
+class Command(BaseCommand):
+    help = "Export the mood_cnn.pth checkpoint as a frozen TorchScript module and an ONNX graph."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--torchscript", help="output path (default: settings.MOOD_MODEL_TORCHSCRIPT_PATH)")
+        parser.add_argument("--onnx", help="output path (default: settings.MOOD_MODEL_ONNX_PATH)")
+        parser.add_argument("--skip-onnx", action="store_true", help="only write the TorchScript module")
+        parser.add_argument("--opset", type=int, default=17)
+
+    def handle(self, *args, **options):
+        model, idx_to_class = mood_model.load_eager()
+        model = model.cpu()
+        class_to_idx = json.dumps({name: idx for idx, name in idx_to_class.items()})
+        example = torch.zeros(1, 1, 48, 48)
+
+        ts_path = options["torchscript"] or str(mood_model.torchscript_path())
+        with torch.no_grad():
+            frozen = torch.jit.freeze(torch.jit.trace(model, example))
+        torch.jit.save(frozen, ts_path, _extra_files={"class_to_idx.json": class_to_idx})
+        self.stdout.write(self.style.SUCCESS(f"TorchScript module written to {ts_path}"))
+
+        if options["skip_onnx"]:
+            return
+
+        import onnx  # optional dependency, only needed for exporting
+
+        onnx_path = options["onnx"] or str(mood_model.onnx_path())
+        torch.onnx.export(
+            model, example, onnx_path,
+            input_names=["image"], output_names=["logits"],
+            dynamic_axes={"image": {0: "batch"}, "logits": {0: "batch"}},
+            opset_version=options["opset"], dynamo=False,
+        )
+        graph = onnx.load(onnx_path)
+        onnx.helper.set_model_props(graph, {"class_to_idx": class_to_idx})
+        onnx.save(graph, onnx_path)
+        self.stdout.write(self.style.SUCCESS(f"ONNX graph written to {onnx_path}"))
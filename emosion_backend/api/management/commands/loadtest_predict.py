@@ -0,0 +1,64 @@
+import statistics
+import threading
+import time
+
+import torch
+from django.core.management.base import BaseCommand
+
+from api import mood_model
+from api.batching import MicroBatcher
+
+
+class Command(BaseCommand):
+    help = ("Load-test the predict inference path in-process: N concurrent clients doing batch-of-1 "
+            "forwards (the unbatched path) vs the same load through the MicroBatcher.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--clients", type=int, default=32, help="concurrent request threads")
+        parser.add_argument("--requests", type=int, default=1024, help="total predictions per run")
+        parser.add_argument("--max-batch-size", type=int, default=16)
+        parser.add_argument("--max-wait-ms", type=float, default=5.0)
+
+    def handle(self, *args, **options):
+        mood_model.warm_up()
+        img = torch.rand(1, 1, 48, 48) * 2 - 1
+
+        direct = self.run_load(lambda: mood_model.predict_batch(img)[0], options)
+        batcher = MicroBatcher(mood_model.predict_batch, options["max_batch_size"], options["max_wait_ms"])
+        batched = self.run_load(lambda: batcher.submit(img).result(), options)
+
+        for name, result in (("unbatched", direct), ("micro-batched", batched)):
+            self.stdout.write(f"{name:<14} {result['throughput']:8.1f} req/s  "
+                              f"p50 {result['p50_ms']:7.2f} ms  p95 {result['p95_ms']:7.2f} ms")
+        stats = batcher.stats()
+        self.stdout.write(f"mean batch size {stats['mean_batch_size']:.2f}, histogram {stats['batch_size_histogram']}")
+        self.stdout.write(self.style.SUCCESS(f"throughput gain x{batched['throughput'] / direct['throughput']:.2f}"))
+
+    def run_load(self, call, options):
+        clients, total = options["clients"], options["requests"]
+        per_client = [total // clients + (1 if i < total % clients else 0) for i in range(clients)]
+        latencies = [[] for _ in range(clients)]
+        barrier = threading.Barrier(clients + 1)
+
+        def client(i):
+            barrier.wait()
+            for _ in range(per_client[i]):
+                start = time.perf_counter()
+                call()
+                latencies[i].append(time.perf_counter() - start)
+
+        threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+        for t in threads:
+            t.start()
+        barrier.wait()
+        start = time.perf_counter()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+
+        flat = sorted(l for per in latencies for l in per)
+        return {
+            "throughput": len(flat) / elapsed,
+            "p50_ms": statistics.median(flat) * 1000,
+            "p95_ms": flat[int(len(flat) * 0.95) - 1] * 1000,
+        }
@@ -0,0 +1,130 @@
+import io
+import json
+import os
+import random
+import time
+
+import torch
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from PIL import Image
+
+from api import mood_model
+
+DEFAULT_DATA_DIR = settings.BASE_DIR.parent / "model"
+
+
+def list_images(data_dir, class_to_idx):
+    """[(path, label)] from an ImageFolder-style directory, using the checkpoint's class indices."""
+    samples = []
+    for name, idx in class_to_idx.items():
+        folder = os.path.join(data_dir, name)
+        if not os.path.isdir(folder):
+            continue
+        samples += [(os.path.join(folder, f), idx) for f in sorted(os.listdir(folder))]
+    return samples
+
+
+def load_batches(samples, batch_size):
+    """Yield (inputs, labels) preprocessed exactly like /api/predict/."""
+    for start in range(0, len(samples), batch_size):
+        chunk = samples[start:start + batch_size]
+        inputs = torch.stack([mood_model.inference_transform(Image.open(path).convert("L")) for path, _ in chunk])
+        yield inputs, torch.tensor([label for _, label in chunk])
+
+
+def serialized_size(module):
+    buffer = io.BytesIO()
+    torch.jit.save(module, buffer)
+    return buffer.tell()
+
+
+class Command(BaseCommand):
+    help = ("Quantize MoodCNN to INT8 (post-training static quantization calibrated on training images) "
+            "and report its accuracy on the test split against the float model.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--calibration-dir", default=str(DEFAULT_DATA_DIR / "train"))
+        parser.add_argument("--calibration-samples", type=int, default=512)
+        parser.add_argument("--test-dir", default=str(DEFAULT_DATA_DIR / "test"))
+        parser.add_argument("--batch-size", type=int, default=64)
+        parser.add_argument("--latency-samples", type=int, default=200, help="single-image forwards to time")
+        parser.add_argument("--output", help="output path (default: settings.MOOD_MODEL_INT8_PATH)")
+        parser.add_argument("--report", help="also write the accuracy report as JSON to this path")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        checkpoint = torch.load(mood_model._checkpoint_path(), map_location=torch.device("cpu"))
+        class_to_idx = checkpoint["class_to_idx"]
+        float_model = mood_model.MoodCNN(num_classes=len(class_to_idx))
+        float_model.load_state_dict(checkpoint["model_state_dict"])
+        float_model.eval()
+
+        # Calibrate on a seeded random sample that covers every class
+        calibration = list_images(options["calibration_dir"], class_to_idx)
+        random.Random(options["seed"]).shuffle(calibration)
+        calibration = calibration[:options["calibration_samples"]]
+        if not calibration:
+            self.stderr.write(f"No calibration images found in {options['calibration_dir']}")
+            return
+        self.stdout.write(f"Calibrating on {len(calibration)} images...")
+        quantized, engine = mood_model.quantize_static(
+            checkpoint["model_state_dict"], len(class_to_idx),
+            (inputs for inputs, _ in load_batches(calibration, options["batch_size"])),
+        )
+
+        example = torch.zeros(1, 1, 48, 48)
+        with torch.no_grad():
+            scripted = torch.jit.freeze(torch.jit.trace(quantized, example))
+        output = options["output"] or str(mood_model.int8_path())
+        torch.jit.save(scripted, output, _extra_files={"class_to_idx.json": json.dumps(class_to_idx),
+                                                       "quant_engine": engine})
+        self.stdout.write(self.style.SUCCESS(f"INT8 model ({engine}) written to {output}"))
+
+        test = list_images(options["test_dir"], class_to_idx)
+        if not test:
+            self.stderr.write(f"No test images found in {options['test_dir']}, skipping the report")
+            return
+        report = self.compare(float_model, scripted, test, options)
+        report.update({"engine": engine, "calibration_samples": len(calibration)})
+        report["float"]["size_bytes"] = serialized_size(torch.jit.trace(float_model, example))
+        report["int8"]["size_bytes"] = serialized_size(scripted)
+
+        self.stdout.write(f"Test images: {report['test_samples']}")
+        for name in ("float", "int8"):
+            r = report[name]
+            self.stdout.write(f"  {name:<6} accuracy {r['accuracy']:.4f}  latency {r['latency_ms']:.3f} ms/image  "
+                              f"size {r['size_bytes'] / 1024:.1f} KiB")
+        self.stdout.write(f"  prediction agreement {report['agreement']:.4f}")
+        if options["report"]:
+            with open(options["report"], "w") as f:
+                json.dump(report, f, indent=2)
+
+    def compare(self, float_model, int8_model, samples, options):
+        correct = {"float": 0, "int8": 0}
+        agree = 0
+        with torch.no_grad():
+            for inputs, labels in load_batches(samples, options["batch_size"]):
+                float_pred = float_model(inputs).argmax(dim=1)
+                int8_pred = int8_model(inputs).argmax(dim=1)
+                correct["float"] += int((float_pred == labels).sum())
+                correct["int8"] += int((int8_pred == labels).sum())
+                agree += int((float_pred == int8_pred).sum())
+
+            # Batch-of-1 latency, the way /api/predict/ calls the model
+            single, _ = next(load_batches(samples[:options["latency_samples"]], options["latency_samples"]))
+            latency = {}
+            for name, model in (("float", float_model), ("int8", int8_model)):
+                model(single[:1])  # warm-up
+                start = time.perf_counter()
+                for i in range(len(single)):
+                    model(single[i:i + 1])
+                latency[name] = (time.perf_counter() - start) / len(single) * 1e3
+
+        n = len(samples)
+        return {
+            "test_samples": n,
+            "agreement": agree / n,
+            "float": {"accuracy": correct["float"] / n, "latency_ms": latency["float"]},
+            "int8": {"accuracy": correct["int8"] / n, "latency_ms": latency["int8"]},
+        }
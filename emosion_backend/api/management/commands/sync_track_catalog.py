@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api import catalog
+from api.spotify_reco import MOOD_PLAYLISTS, MOOD_PLAYLIST_MAP, sp
+
+
+def playlist_tracks(playlist_id):
+    """Every track object of a playlist, following Spotify's pagination past the first 100."""
+    page = sp.playlist_items(playlist_id, additional_types=["track"], limit=100)
+    tracks = []
+    while page:
+        tracks += [item.get("track") for item in page["items"]]
+        page = sp.next(page) if page.get("next") else None
+    return tracks
+
+
+class Command(BaseCommand):
+    help = ("Copy the mood playlists (spotify_reco.MOOD_PLAYLISTS and MOOD_PLAYLIST_MAP) into the "
+            "Track table so recommendations are sampled locally instead of calling Spotify.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--mood", action="append", help="only sync these moods (repeatable)")
+
+    def handle(self, *args, **options):
+        playlists = [(mood, pid) for mapping in (MOOD_PLAYLISTS, MOOD_PLAYLIST_MAP) for mood, pid in mapping.items()]
+        if options["mood"]:
+            playlists = [(mood, pid) for mood, pid in playlists if mood in options["mood"]]
+            if not playlists:
+                raise CommandError(f"No playlists for moods {options['mood']}")
+
+        failed = 0
+        for mood, playlist_id in dict.fromkeys(playlists):
+            try:
+                count = catalog.sync_playlist(playlist_id, mood, playlist_tracks(playlist_id))
+            except Exception as e:
+                failed += 1
+                self.stderr.write(f"{mood:<10} {playlist_id}: failed ({e})")
+                continue
+            self.stdout.write(f"{mood:<10} {playlist_id}: {count} tracks")
+        if failed:
+            raise CommandError(f"{failed} playlist(s) could not be synced")
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_remove_track_post_post_tracks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='track',
+            name='preview_url',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='PlaylistTrack',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('playlist_id', models.CharField(max_length=50)),
+                ('mood', models.CharField(max_length=10)),
+                ('position', models.IntegerField()),
+                ('synced_at', models.DateTimeField(auto_now=True)),
+                ('track', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='playlist_entries', to='api.track')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['mood'], name='playlisttrack_mood_idx')],
+                'constraints': [models.UniqueConstraint(fields=('playlist_id', 'position'), name='unique_playlist_position')],
+            },
+        ),
+    ]
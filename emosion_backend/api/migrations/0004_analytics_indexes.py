@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_track_catalog'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='listeninghistory',
+            index=models.Index(fields=['mood', 'listen_count'], name='history_mood_count_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='listeninghistory',
+            index=models.Index(fields=['user', 'mood'], name='history_user_mood_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='listeninghistory',
+            index=models.Index(fields=['user', 'last_listened_at'], name='history_user_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mooddetection',
+            index=models.Index(fields=['user', 'created_at'], name='mood_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mooddetection',
+            index=models.Index(fields=['mood', 'created_at'], name='mood_mood_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mooddetection',
+            index=models.Index(fields=['user', 'mood'], name='mood_user_mood_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['user', 'created_at'], name='post_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trackfavorite',
+            index=models.Index(fields=['user', 'created_at'], name='favorite_user_created_idx'),
+        ),
+    ]
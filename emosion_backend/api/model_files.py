@@ -0,0 +1,65 @@
+import hashlib
+import threading
+from pathlib import Path
+
+from django.conf import settings
+
+# Where each inference backend's model file lives, and a version string derived from
+# it. Nothing here imports torch, so callers can key caches on the model version
+# without loading the model.
+
+BACKENDS = ("eager", "torchscript", "onnx", "int8")
+
+
+def _checkpoint_path():
+    return Path(getattr(settings, "MOOD_MODEL_PATH", Path(__file__).resolve().parent / "mood_cnn.pth"))
+
+
+def torchscript_path():
+    return Path(getattr(settings, "MOOD_MODEL_TORCHSCRIPT_PATH", None) or _checkpoint_path().with_suffix(".ts"))
+
+
+def onnx_path():
+    return Path(getattr(settings, "MOOD_MODEL_ONNX_PATH", None) or _checkpoint_path().with_suffix(".onnx"))
+
+
+def int8_path():
+    checkpoint = _checkpoint_path()
+    return Path(getattr(settings, "MOOD_MODEL_INT8_PATH", None) or checkpoint.with_name(checkpoint.stem + ".int8.ts"))
+
+
+MODEL_FILES = {"eager": _checkpoint_path, "torchscript": torchscript_path, "onnx": onnx_path, "int8": int8_path}
+
+
+def current_backend():
+    backend = getattr(settings, "MOOD_MODEL_BACKEND", "eager")
+    if backend not in MODEL_FILES:
+        raise ValueError(f"Unknown MOOD_MODEL_BACKEND '{backend}', expected one of {BACKENDS}")
+    return backend
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+_versions = {}
+_versions_lock = threading.Lock()
+
+
+def model_version():
+    """
+    Backend name plus a digest of its model file, e.g. "eager-1a2b...". Hashed once per
+    (backend, path) and process, like the model itself is loaded once.
+    """
+    backend = current_backend()
+    path = MODEL_FILES[backend]()
+    key = (backend, str(path))
+    if key not in _versions:
+        with _versions_lock:
+            if key not in _versions:
+                _versions[key] = f"{backend}-{file_digest(path)}"
+    return _versions[key]
@@ -19,6 +19,11 @@ class Post(models.Model):
     tracks = models.ManyToManyField('Track', related_name='posts', blank=True)  # multiple tracks
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at'], name='post_user_created_idx'),
+        ]
+
 
 class Track(models.Model):
     spotify_id = models.CharField(unique=True, max_length=50)
@@ -28,9 +33,28 @@ class Track(models.Model):
     duration_ms = models.IntegerField()
     genre = models.CharField(max_length=50, null=True, blank=True)
     image_url = models.TextField(null=True, blank=True)
+    preview_url = models.TextField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
 
+class PlaylistTrack(models.Model):
+    # Local copy of a mood playlist's contents, filled by `manage.py sync_track_catalog`.
+    # position is dense (0..n-1) per playlist so random samples are index lookups.
+    playlist_id = models.CharField(max_length=50)
+    mood = models.CharField(max_length=10)
+    track = models.ForeignKey(Track, on_delete=models.CASCADE, related_name='playlist_entries')
+    position = models.IntegerField()
+    synced_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['playlist_id', 'position'], name='unique_playlist_position')
+        ]
+        indexes = [
+            models.Index(fields=['mood'], name='playlisttrack_mood_idx'),
+        ]
+
+
 class TrackFavorite(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     track = models.ForeignKey(Track, on_delete=models.CASCADE)
@@ -40,6 +64,9 @@ class TrackFavorite(models.Model):
         constraints = [
             models.UniqueConstraint(fields=['user', 'track'], name='unique_user_track_favorite')
         ]
+        indexes = [
+            models.Index(fields=['user', 'created_at'], name='favorite_user_created_idx'),
+        ]
 
 
 class MoodDetection(models.Model):
@@ -56,6 +83,14 @@ class MoodDetection(models.Model):
     confidence = models.FloatField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # Moods over time per user, mood trends across users, mood counts per user
+        indexes = [
+            models.Index(fields=['user', 'created_at'], name='mood_user_created_idx'),
+            models.Index(fields=['mood', 'created_at'], name='mood_mood_created_idx'),
+            models.Index(fields=['user', 'mood'], name='mood_user_mood_idx'),
+        ]
+
 
 class ListeningHistory(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -68,3 +103,9 @@ class ListeningHistory(models.Model):
         constraints = [
             models.UniqueConstraint(fields=['user', 'track'], name='unique_user_track_history')
         ]
+        # Top tracks per mood, a user's tracks per mood, recently played
+        indexes = [
+            models.Index(fields=['mood', 'listen_count'], name='history_mood_count_idx'),
+            models.Index(fields=['user', 'mood'], name='history_user_mood_idx'),
+            models.Index(fields=['user', 'last_listened_at'], name='history_user_recent_idx'),
+        ]
@@ -1,6 +1,20 @@
+import asyncio
+import io
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 import torch
+from PIL import Image
 from torchvision import transforms
 import torch.nn as nn
+from django.conf import settings
+
+from .model_files import _checkpoint_path, current_backend, int8_path, model_version, onnx_path, torchscript_path
+
+logger = logging.getLogger(__name__)
 
 # --- CNN Architecture ---
 class MoodCNN(nn.Module):
@@ -36,18 +50,212 @@ class MoodCNN(nn.Module):
         return x
 
 
-# --- Device & Model Setup ---
+class QuantizableMoodCNN(MoodCNN):
+    """MoodCNN with quant/dequant stubs around it, for eager-mode post-training static quantization."""
+    def __init__(self, num_classes=5):
+        super().__init__(num_classes)
+        self.quant = torch.ao.quantization.QuantStub()
+        self.dequant = torch.ao.quantization.DeQuantStub()
+
+    def forward(self, x):
+        return self.dequant(super().forward(self.quant(x)))
+
+
+# Conv/Linear + following ReLU pairs, fused into single int8 ops
+_FUSE_GROUPS = [["features.0", "features.1"], ["features.3", "features.4"], ["features.6", "features.7"],
+                ["features.9", "features.10"], ["classifier.1", "classifier.2"]]
+
+
+def quantize_static(state_dict, num_classes, calibration_batches, engine=None):
+    """
+    Post-training static INT8 quantization: fuse Conv/Linear+ReLU, observe activation ranges
+    on the calibration batches (float tensors shaped like inference input), then convert.
+    """
+    engine = engine or next(e for e in ("x86", "fbgemm", "qnnpack")
+                            if e in torch.backends.quantized.supported_engines)
+    torch.backends.quantized.engine = engine
+
+    model = QuantizableMoodCNN(num_classes=num_classes)
+    model.load_state_dict(state_dict)
+    model.eval()
+    model = torch.ao.quantization.fuse_modules(model, _FUSE_GROUPS)
+    model.qconfig = torch.ao.quantization.get_default_qconfig(engine)
+    torch.ao.quantization.prepare(model, inplace=True)
+    with torch.no_grad():
+        for batch in calibration_batches:
+            model(batch)
+    torch.ao.quantization.convert(model, inplace=True)
+    return model, engine
+
+
+# --- Device & Model Registry ---
+# The checkpoint is loaded on first use (or by warm_up() at server start), not at import,
+# so management commands, migrations and test workers never pay for it.
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-model = MoodCNN(num_classes=5).to(device)
 
-checkpoint = torch.load(
-    r"C:/moodcnnProgram/emosion_backend/api/mood_cnn.pth",
-    map_location=torch.device("cpu")
-)
-model.load_state_dict(checkpoint["model_state_dict"])
-model.eval()
+_model = None
+_idx_to_class = None
+_model_lock = threading.Lock()
+
+# Every backend returns (model, idx_to_class) where model(tensor) -> logits tensor,
+# so callers do not care which runtime is underneath.
+
+
+def load_eager():
+    checkpoint = torch.load(_checkpoint_path(), map_location=torch.device("cpu"))
+
+    model = MoodCNN(num_classes=len(checkpoint["class_to_idx"]))
+    model.load_state_dict(checkpoint["model_state_dict"])
+    model.to(device)
+    model.eval()
+
+    idx_to_class = {v: k for k, v in checkpoint["class_to_idx"].items()}
+    return model, idx_to_class
+
+
+def load_torchscript():
+    extra_files = {"class_to_idx.json": ""}
+    model = torch.jit.load(str(torchscript_path()), map_location=device, _extra_files=extra_files)
+    model.eval()
+    class_to_idx = json.loads(extra_files["class_to_idx.json"])
+    return model, {v: k for k, v in class_to_idx.items()}
+
+
+class OnnxMoodModel:
+    """ONNX Runtime (CPU) session behind the same tensor-in, logits-tensor-out call as MoodCNN."""
+    def __init__(self, path):
+        import onnxruntime as ort  # optional dependency, only needed for this backend
+        self.session = ort.InferenceSession(str(path), providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self.class_to_idx = json.loads(self.session.get_modelmeta().custom_metadata_map["class_to_idx"])
+
+    def __call__(self, img_tensor):
+        logits = self.session.run(None, {self.input_name: img_tensor.detach().cpu().numpy()})[0]
+        return torch.from_numpy(logits)
+
+
+def load_onnx():
+    model = OnnxMoodModel(onnx_path())
+    return model, {v: k for k, v in model.class_to_idx.items()}
+
+
+class Int8MoodModel:
+    """Quantized TorchScript module; quantized kernels are CPU-only, so inputs are moved there."""
+    def __init__(self, path):
+        extra_files = {"class_to_idx.json": "", "quant_engine": ""}
+        self.module = torch.jit.load(str(path), map_location="cpu", _extra_files=extra_files)
+        self.module.eval()
+        engine = extra_files["quant_engine"]
+        torch.backends.quantized.engine = engine.decode() if isinstance(engine, bytes) else engine
+        self.class_to_idx = json.loads(extra_files["class_to_idx.json"])
+
+    def __call__(self, img_tensor):
+        return self.module(img_tensor.cpu())
+
+
+def load_int8():
+    model = Int8MoodModel(int8_path())
+    return model, {v: k for k, v in model.class_to_idx.items()}
+
+
+_LOADERS = {"eager": load_eager, "torchscript": load_torchscript, "onnx": load_onnx, "int8": load_int8}
+
+
+def _load_model():
+    backend = current_backend()
+    threads = getattr(settings, "MOOD_MODEL_THREADS", 0)
+    if threads:
+        torch.set_num_threads(threads)
+    model, idx_to_class = _LOADERS[backend]()
+    logger.info("Loaded mood model %s", model_version())
+    return model, idx_to_class
+
+
+def _ensure_loaded():
+    global _model, _idx_to_class
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                _model, _idx_to_class = _load_model()
+
+
+def get_model():
+    """Return (model, idx_to_class), loading the checkpoint once per process (thread-safe)."""
+    _ensure_loaded()
+    return _model, _idx_to_class
+
+
+def predict_batch(img_tensors):
+    """Classify a (N, 1, 48, 48) batch in one forward pass. Returns [(mood, confidence)] per image."""
+    model, idx_to_class = get_model()
+    with torch.no_grad():
+        probs = torch.softmax(model(img_tensors.to(device)), dim=1).cpu()
+    confidences, indices = probs.max(dim=1)
+    return [(idx_to_class.get(int(i), "neutral"), float(c)) for i, c in zip(indices, confidences)]
+
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+
+def get_batcher():
+    """The process-wide MicroBatcher, or None when MOOD_BATCHING is off."""
+    global _batcher
+    if not getattr(settings, "MOOD_BATCHING", False):
+        return None
+    if _batcher is None:
+        with _batcher_lock:
+            if _batcher is None:
+                from .batching import MicroBatcher
+                _batcher = MicroBatcher(
+                    predict_batch,
+                    max_batch_size=getattr(settings, "MOOD_BATCH_MAX_SIZE", 16),
+                    max_wait_ms=getattr(settings, "MOOD_BATCH_MAX_WAIT_MS", 5.0),
+                )
+    return _batcher
+
+
+def predict_one(img_tensor):
+    """Classify a single (1, 1, 48, 48) tensor, through the micro-batcher when it is enabled."""
+    batcher = get_batcher()
+    if batcher is None:
+        return predict_batch(img_tensor)[0]
+    return batcher.submit(img_tensor).result()
+
+
+_inference_executor = None
+
+
+def get_inference_executor():
+    """Bounded pool the async views run decoding and inference on (MOOD_INFERENCE_WORKERS threads)."""
+    global _inference_executor
+    if _inference_executor is None:
+        with _batcher_lock:
+            if _inference_executor is None:
+                _inference_executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, "MOOD_INFERENCE_WORKERS", 2), thread_name_prefix="mood-inference")
+    return _inference_executor
+
+
+async def predict_one_async(img_tensor):
+    """
+    Awaitable predict_one. With micro-batching the batcher's Future is awaited directly,
+    so no thread waits at all; otherwise the forward pass runs on the inference pool.
+    """
+    batcher = get_batcher()
+    if batcher is not None:
+        return await asyncio.wrap_future(batcher.submit(img_tensor))
+    loop = asyncio.get_running_loop()
+    results = await loop.run_in_executor(get_inference_executor(), predict_batch, img_tensor)
+    return results[0]
+
+
+def warm_up():
+    """Load the model and run one dummy forward pass, so the first real request is not the slow one."""
+    model, _ = get_model()
+    with torch.no_grad():
+        model(torch.zeros(1, 1, 48, 48, device=device))
 
-idx_to_class = {v: k for k, v in checkpoint["class_to_idx"].items()}
 
 # --- Image Transform ---
 inference_transform = transforms.Compose([
@@ -56,3 +264,19 @@ inference_transform = transforms.Compose([
     transforms.ToTensor(),
     transforms.Normalize((0.5,), (0.5,))
 ])
+
+INPUT_SIZE = (48, 48)
+
+
+def preprocess_bytes(data):
+    """
+    Encoded image bytes -> normalized (1, 1, 48, 48) float tensor, decoded once.
+    For JPEGs, draft() lets libjpeg decode straight to grayscale at the smallest DCT
+    scale (1/2 .. 1/8) still >= 48x48, so a phone photo is never decoded at full size.
+    Otherwise equivalent to inference_transform (bilinear resize, (x - 0.5) / 0.5).
+    """
+    img = Image.open(io.BytesIO(data))
+    img.draft("L", INPUT_SIZE)
+    img = img.convert("L").resize(INPUT_SIZE, Image.BILINEAR)
+    pixels = np.asarray(img, dtype=np.float32) / 255.0
+    return torch.from_numpy((pixels - 0.5) / 0.5).reshape(1, 1, *INPUT_SIZE)
@@ -0,0 +1,53 @@
+import hashlib
+import os
+
+from django.core.cache import caches
+from django.core.files.storage import default_storage
+
+from . import jobs
+
+# Cache alias from settings.CACHES; eviction (TTL/LRU) is configured there
+CACHE_ALIAS = "predictions"
+
+
+def content_digest(data):
+    """sha256 hex digest of the upload's bytes."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def content_addressed_name(digest, original_name):
+    ext = os.path.splitext(original_name)[1].lower()
+    return f"uploads/{digest}{ext}"
+
+
+def persist_content_addressed(data, original_name, digest):
+    """
+    Queue the upload to be stored under its content hash (plus a thumbnail) and return
+    (saved_name, url, job_id) right away; the name is derived from the bytes, so the URL
+    is known before the write.
+    """
+    name = content_addressed_name(digest, original_name)
+    return name, default_storage.url(name), store_content_addressed(data, name)
+
+
+def store_content_addressed(data, name):
+    """
+    Queue the job that stores `data` (and its thumbnail) under `name`; returns the job id.
+    Cache hits queue it again: it only checks exists() when the files are there, and it
+    rewrites them when an earlier job failed after the prediction was cached.
+    """
+    return jobs.get_queue().submit("upload", jobs.store_upload, name, data)
+
+
+def _key(digest, model_version):
+    return f"prediction:{model_version}:{digest}"
+
+
+def get_prediction(digest, model_version):
+    """Cached {"mood", "confidence", "saved_name"} for these bytes under this model, or None."""
+    return caches[CACHE_ALIAS].get(_key(digest, model_version))
+
+
+def set_prediction(digest, model_version, mood, confidence, saved_name):
+    caches[CACHE_ALIAS].set(_key(digest, model_version),
+                            {"mood": mood, "confidence": confidence, "saved_name": saved_name})
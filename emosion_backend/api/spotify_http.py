@@ -0,0 +1,148 @@
+import logging
+import re
+import threading
+import time
+from collections import defaultdict
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# Spotify ids are 22 base62 characters; folding them keeps one latency bucket per endpoint
+_SPOTIFY_ID = re.compile(r"\b[0-9A-Za-z]{22}\b")
+RETRY_STATUSES = {429, 502, 503, 504}
+
+
+class SpotifyHTTP:
+    """
+    Shared HTTP layer for the Spotify Web API and accounts service.
+
+    One requests.Session with a keep-alive pool, so calls reuse TLS connections instead
+    of handshaking every time. Every call gets (connect, read) timeouts. 429 and 502/503/504
+    are retried up to max_retries times, sleeping for Retry-After when Spotify sends it
+    (capped at max_retry_after) and exponential backoff otherwise; connection errors are
+    retried for GETs only. A retry whose wait would end past time_budget seconds from the
+    start of the call is not made: the last response (or error) is returned instead, so a
+    call holds its thread for at most time_budget plus one request timeout. Latency per
+    endpoint is kept for stats().
+    """
+    def __init__(self, api_base="https://api.spotify.com/v1", accounts_base="https://accounts.spotify.com",
+                 connect_timeout=3.05, read_timeout=10.0, max_retries=3, backoff=0.5, max_retry_after=10.0,
+                 time_budget=15.0, pool_size=10):
+        self.api_base = api_base.rstrip("/")
+        self.accounts_base = accounts_base.rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_retry_after = max_retry_after
+        self.time_budget = time_budget
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._stats_lock = threading.Lock()
+        self._stats = defaultdict(lambda: {"calls": 0, "errors": 0, "retries": 0, "total_ms": 0.0, "max_ms": 0.0})
+
+    # ---- public calls ----
+
+    def api_get(self, endpoint, access_token, params=None):
+        """GET https://api.spotify.com/v1/<endpoint> with a bearer token."""
+        return self.request("GET", f"{self.api_base}/{endpoint.lstrip('/')}", label=f"GET {endpoint}",
+                            headers={"Authorization": f"Bearer {access_token}"}, params=params)
+
+    def token_request(self, data, basic_auth):
+        """POST form `data` to the accounts token endpoint with a Basic auth header value."""
+        headers = {"Authorization": f"Basic {basic_auth}", "Content-Type": "application/x-www-form-urlencoded"}
+        return self.request("POST", f"{self.accounts_base}/api/token", label="POST token", headers=headers, data=data)
+
+    def request(self, method, url, label=None, **kwargs):
+        label = _SPOTIFY_ID.sub("{id}", (label or url).split("?")[0])
+        kwargs.setdefault("timeout", self.timeout)
+        deadline = time.monotonic() + self.time_budget
+        for attempt in range(self.max_retries + 1):
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                self._record(label, time.perf_counter() - start, error=True)
+                delay = self.backoff * 2 ** attempt
+                if method != "GET" or attempt == self.max_retries or not self._fits(deadline, delay):
+                    raise
+                self._sleep(label, delay)
+                continue
+
+            self._record(label, time.perf_counter() - start, error=response.status_code >= 400)
+            if response.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+                return response
+            if response.status_code != 429 and method != "GET":
+                return response  # only a 429 guarantees a POST was not processed
+            delay = self._retry_delay(response, attempt)
+            if not self._fits(deadline, delay):
+                logger.warning("Spotify %s returned %s; retrying in %.1fs would exceed the %.0fs budget",
+                               label, response.status_code, delay, self.time_budget)
+                return response
+            logger.warning("Spotify %s returned %s (attempt %d)", label, response.status_code, attempt + 1)
+            self._sleep(label, delay)
+        return response
+
+    def stats(self):
+        """{endpoint: {calls, errors, retries, total_ms, max_ms, mean_ms}}"""
+        with self._stats_lock:
+            return {label: {**s, "mean_ms": s["total_ms"] / s["calls"] if s["calls"] else 0.0}
+                    for label, s in self._stats.items()}
+
+    # ---- internals ----
+
+    def _retry_delay(self, response, attempt):
+        retry_after = response.headers.get("Retry-After")
+        if retry_after is not None:
+            try:
+                return min(max(float(retry_after), 0.0), self.max_retry_after)
+            except ValueError:
+                pass  # HTTP-date form; Spotify sends seconds
+        return self.backoff * 2 ** attempt
+
+    @staticmethod
+    def _fits(deadline, delay):
+        return time.monotonic() + delay < deadline
+
+    def _sleep(self, label, seconds):
+        with self._stats_lock:
+            self._stats[label]["retries"] += 1
+        time.sleep(seconds)
+
+    def _record(self, label, seconds, error=False):
+        ms = seconds * 1000
+        with self._stats_lock:
+            s = self._stats[label]
+            s["calls"] += 1
+            s["errors"] += int(error)
+            s["total_ms"] += ms
+            s["max_ms"] = max(s["max_ms"], ms)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """The process-wide SpotifyHTTP built from the SPOTIFY_* settings."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = SpotifyHTTP(
+                    api_base=getattr(settings, "SPOTIFY_API_BASE", "https://api.spotify.com/v1"),
+                    accounts_base=getattr(settings, "SPOTIFY_ACCOUNTS_BASE", "https://accounts.spotify.com"),
+                    connect_timeout=getattr(settings, "SPOTIFY_CONNECT_TIMEOUT", 3.05),
+                    read_timeout=getattr(settings, "SPOTIFY_READ_TIMEOUT", 10.0),
+                    max_retries=getattr(settings, "SPOTIFY_MAX_RETRIES", 3),
+                    max_retry_after=getattr(settings, "SPOTIFY_MAX_RETRY_AFTER", 10.0),
+                    time_budget=getattr(settings, "SPOTIFY_TIME_BUDGET", 15.0),
+                    pool_size=getattr(settings, "SPOTIFY_POOL_SIZE", 10),
+                )
+    return _client
@@ -2,6 +2,13 @@ import spotipy
 from spotipy.oauth2 import SpotifyClientCredentials
 import random
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from .spotify_tokens import DjangoCacheHandler
 
 logger = logging.getLogger(__name__)
 
@@ -13,38 +20,43 @@ MOOD_PLAYLISTS = {
     "surprise": "0oxevpSGR2zITpujzwPCmj"
 }
 
-# Initialize Spotify client
-sp = spotipy.Spotify(auth_manager=SpotifyClientCredentials(), requests_timeout=20)
+# Playlists behind the /mood_tracks/ page
+MOOD_PLAYLIST_MAP = {
+    "happy": "37i9dQZF1DXdPec7aLTmlC",
+    "neutral": "37i9dQZF1DX4WYpdgoIcn6",
+    "sad": "37i9dQZF1DX7qK8ma5wgG1",
+    "surprise": "37i9dQZF1DWVRSukIED0ZB",
+}
+
+# Initialize Spotify client; its app token is shared by all workers through the cache
+sp = spotipy.Spotify(auth_manager=SpotifyClientCredentials(cache_handler=DjangoCacheHandler()), requests_timeout=20)
+
+PLAYLIST_ITEMS_URL = "https://api.spotify.com/v1/playlists/{playlist_id}/tracks"
+
+# Cache alias from settings.CACHES holding the normalized tracks of each playlist
+CACHE_ALIAS = "playlists"
+
+# Stale entries are refreshed here, off the request path; one refresh per playlist at a time
+_refresh_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="playlist-refresh")
+_refreshing = set()
+_refreshing_lock = threading.Lock()
 
-def recommend_song_for_mood(mood: str, num_tracks: int = 6):
-    """
-    Return a list of recommended tracks based on the given mood.
-    Each track includes id, name, artists, album cover, Spotify URL, and preview URL.
-    """
-    mood_lower = mood.lower()
-    playlist_id = MOOD_PLAYLISTS.get(mood_lower)
 
+def playlist_for_mood(mood):
+    playlist_id = MOOD_PLAYLISTS.get(mood.lower())
     if not playlist_id:
         logger.warning("Mood '%s' not found. Defaulting to 'happy'.", mood)
         playlist_id = MOOD_PLAYLISTS["happy"]
+    return playlist_id
 
-    try:
-        # Fetch all tracks from playlist
-        results = sp.playlist_items(playlist_id, additional_types=['track'], limit=100)
-        tracks = [item['track'] for item in results['items'] if item.get('track')]
-    except Exception as e:
-        logger.exception("Failed to fetch playlist tracks for mood '%s'", mood)
-        return []
-
-    if not tracks:
-        logger.warning("No tracks found in playlist '%s'", playlist_id)
-        return []
-
-    # Randomly pick `num_tracks` without repeats
-    sampled_tracks = random.sample(tracks, min(num_tracks, len(tracks)))
 
+def _normalize_tracks(results):
+    """Playlist-items page -> the track dicts the API returns."""
     final_recs = []
-    for track in sampled_tracks:
+    for item in results['items']:
+        track = item.get('track')
+        if not track:
+            continue
         spotify_id = track.get("id")
         name = track.get("name")
         artists = ", ".join([a.get("name") for a in track.get("artists", []) if a.get("name")])
@@ -63,6 +75,162 @@ def recommend_song_for_mood(mood: str, num_tracks: int = 6):
 
     return final_recs
 
+
+def _sample(tracks, num_tracks):
+    # Randomly pick `num_tracks` without repeats
+    return random.sample(tracks, min(num_tracks, len(tracks)))
+
+
+# ===================== Playlist cache =====================
+# Entries are {"tracks": [...], "fetched_at": epoch seconds}. Younger than
+# SPOTIFY_PLAYLIST_TTL they are fresh; older ones are still served while a background
+# refresh runs, until SPOTIFY_PLAYLIST_MAX_STALE lets the cache drop them.
+
+def _cache_key(playlist_id):
+    return f"playlist:{playlist_id}"
+
+
+def _store(playlist_id, tracks):
+    ttl = getattr(settings, "SPOTIFY_PLAYLIST_TTL", 3600)
+    max_stale = getattr(settings, "SPOTIFY_PLAYLIST_MAX_STALE", 24 * 3600)
+    caches[CACHE_ALIAS].set(_cache_key(playlist_id), {"tracks": tracks, "fetched_at": time.time()},
+                            timeout=ttl + max_stale)
+
+
+def _is_stale(entry):
+    return time.time() - entry["fetched_at"] > getattr(settings, "SPOTIFY_PLAYLIST_TTL", 3600)
+
+
+def _fetch_playlist(playlist_id):
+    results = sp.playlist_items(playlist_id, additional_types=['track'], limit=100)
+    tracks = _normalize_tracks(results)
+    if tracks:
+        _store(playlist_id, tracks)
+    return tracks
+
+
+def _refresh(playlist_id):
+    try:
+        _fetch_playlist(playlist_id)
+    except Exception:
+        # Keep serving the stale copy; the next request past the TTL tries again
+        logger.exception("Background refresh of playlist '%s' failed", playlist_id)
+    finally:
+        with _refreshing_lock:
+            _refreshing.discard(playlist_id)
+
+
+def _schedule_refresh(playlist_id):
+    with _refreshing_lock:
+        if playlist_id in _refreshing:
+            return
+        _refreshing.add(playlist_id)
+    _refresh_executor.submit(_refresh, playlist_id)
+
+
+def _cached_tracks(playlist_id):
+    """Cached tracks (scheduling a refresh if they are stale), or None on a miss."""
+    entry = caches[CACHE_ALIAS].get(_cache_key(playlist_id))
+    if entry is None:
+        return None
+    if _is_stale(entry):
+        _schedule_refresh(playlist_id)
+    return entry["tracks"]
+
+
+def get_playlist_tracks(playlist_id):
+    """Normalized tracks of a playlist: from the cache when present, fetched on a miss."""
+    tracks = _cached_tracks(playlist_id)
+    return tracks if tracks is not None else _fetch_playlist(playlist_id)
+
+
+def _from_catalog(playlist_id, num_tracks):
+    """Sample from the local track catalog; [] if the playlist was never synced."""
+    from . import catalog
+
+    return [catalog.as_recommendation(t) for t in catalog.sample_or_empty(playlist_id, num_tracks)]
+
+
+def recommend_song_for_mood(mood: str, num_tracks: int = 6):
+    """
+    Return a list of recommended tracks based on the given mood.
+    Each track includes id, name, artists, album cover, Spotify URL, and preview URL.
+    Served from the local catalog (`manage.py sync_track_catalog`) when the playlist is
+    synced, otherwise from the cached Spotify playlist.
+    """
+    playlist_id = playlist_for_mood(mood)
+    final_recs = _from_catalog(playlist_id, num_tracks)
+    if final_recs:
+        return final_recs
+
+    try:
+        tracks = get_playlist_tracks(playlist_id)
+    except Exception as e:
+        logger.exception("Failed to fetch playlist tracks for mood '%s'", mood)
+        return []
+
+    if not tracks:
+        logger.warning("No tracks found in playlist '%s'", playlist_id)
+        return []
+    return _sample(tracks, num_tracks)
+
+
+def cached_recommendations(mood: str, num_tracks: int = 6):
+    """Recommendations from the catalog or the playlist cache only; [] rather than calling Spotify."""
+    playlist_id = playlist_for_mood(mood)
+    final_recs = _from_catalog(playlist_id, num_tracks)
+    if final_recs:
+        return final_recs
+    entry = caches[CACHE_ALIAS].get(_cache_key(playlist_id))
+    return _sample(entry["tracks"], num_tracks) if entry else []
+
+
+async def _fetch_playlist_async(playlist_id, client=None):
+    import httpx  # optional dependency, only needed by the async views
+
+    # Client-credentials token is cached by spotipy; only a refresh does network I/O
+    token = await sync_to_async(sp.auth_manager.get_access_token, thread_sensitive=False)(as_dict=False)
+    request_kwargs = {
+        "params": {"limit": 100, "additional_types": "track"},
+        "headers": {"Authorization": f"Bearer {token}"},
+    }
+    url = PLAYLIST_ITEMS_URL.format(playlist_id=playlist_id)
+    if client is None:
+        async with httpx.AsyncClient(timeout=getattr(settings, "SPOTIFY_REQUEST_TIMEOUT", 20)) as client:
+            response = await client.get(url, **request_kwargs)
+    else:
+        response = await client.get(url, **request_kwargs)
+    response.raise_for_status()
+    tracks = _normalize_tracks(response.json())
+    if tracks:
+        _store(playlist_id, tracks)
+    return tracks
+
+
+async def recommend_song_for_mood_async(mood: str, num_tracks: int = 6, client=None):
+    """
+    Same as recommend_song_for_mood, but a cache miss is fetched through httpx's async
+    client, so waiting on Spotify does not hold a worker thread. Pass an httpx.AsyncClient
+    to reuse its connections; otherwise a short-lived one is opened.
+    """
+    playlist_id = playlist_for_mood(mood)
+    final_recs = await sync_to_async(_from_catalog)(playlist_id, num_tracks)
+    if final_recs:
+        return final_recs
+
+    try:
+        tracks = _cached_tracks(playlist_id)
+        if tracks is None:
+            tracks = await _fetch_playlist_async(playlist_id, client)
+    except Exception:
+        logger.exception("Failed to fetch playlist tracks for mood '%s'", mood)
+        return []
+
+    if not tracks:
+        logger.warning("No tracks found in playlist '%s'", playlist_id)
+        return []
+    return _sample(tracks, num_tracks)
+
 # Example usage:
 if __name__ == "__main__":
     mood = "surprise"
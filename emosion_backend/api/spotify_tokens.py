@@ -0,0 +1,188 @@
+import base64
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlencode
+
+import requests
+from django.conf import settings
+from django.core.cache import caches
+from spotipy.cache_handler import CacheHandler
+
+from . import spotify_http
+
+try:
+    import fcntl
+except ImportError:  # Windows: refreshes are only single-flight within a process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Cache alias from settings.CACHES shared by all worker processes
+CACHE_ALIAS = "spotify_tokens"
+
+SESSION_ACCESS = "spotify_access_token"
+SESSION_REFRESH = "spotify_refresh_token"
+SESSION_EXPIRES = "spotify_expires_at"
+
+
+def get_spotify_client_credentials():
+    client_id = os.environ.get('SPOTIPY_CLIENT_ID')
+    client_secret = os.environ.get('SPOTIPY_CLIENT_SECRET')
+    if not client_id or not client_secret:
+        raise ValueError("Spotify credentials not set in environment variables")
+    return client_id, client_secret
+
+
+def basic_auth_header():
+    client_id, client_secret = get_spotify_client_credentials()
+    return base64.b64encode(f"{client_id}:{client_secret}".encode()).decode()
+
+
+def _margin():
+    return getattr(settings, "SPOTIFY_TOKEN_REFRESH_MARGIN", 60)
+
+
+# ===================== User (authorization code) tokens =====================
+
+def store_user_token(session, token_info):
+    """Save a token endpoint response in the session, including when it expires."""
+    session[SESSION_ACCESS] = token_info["access_token"]
+    if token_info.get("refresh_token"):
+        session[SESSION_REFRESH] = token_info["refresh_token"]
+    session[SESSION_EXPIRES] = token_info.get("expires_at") or time.time() + token_info.get("expires_in", 3600)
+
+
+def get_user_token(request):
+    """
+    The session's access token, refreshed first if it expires within
+    SPOTIFY_TOKEN_REFRESH_MARGIN seconds. None when the session has no Spotify login.
+    """
+    session = request.session
+    token = session.get(SESSION_ACCESS)
+    if not token:
+        return None
+    expires_at = session.get(SESSION_EXPIRES)
+    if expires_at is None or time.time() < expires_at - _margin():
+        return token  # fresh, or a session from before expiry was tracked (the 401 path handles it)
+    refreshed = refresh_user_token(request)
+    if refreshed:
+        return refreshed
+    return token if time.time() < expires_at else None
+
+
+def refresh_user_token(request, stale_token=None):
+    """
+    Refresh the session's access token, at most once across all requests and processes
+    sharing the refresh token: the first caller takes the refresh lock and refreshes, the
+    others wait for it and adopt its result from the shared cache. stale_token is a token
+    Spotify just rejected, so a shared copy of it is not reused. Returns the new token or None.
+    """
+    session = request.session
+    refresh_token = session.get(SESSION_REFRESH)
+    if not refresh_token:
+        return None
+
+    cache = caches[CACHE_ALIAS]
+    key = "user:" + hashlib.sha256(refresh_token.encode()).hexdigest()
+
+    def shared_token():
+        entry = cache.get(key)
+        if entry and entry["access_token"] != stale_token and time.time() < entry["expires_at"] - _margin():
+            return entry
+        return None
+
+    entry = shared_token()
+    if entry is None:
+        with refresh_lock(key):
+            entry = shared_token() or _request_refresh(refresh_token)
+            if entry is not None:
+                cache.set(key, entry, timeout=max(int(entry["expires_at"] - time.time()), 1))
+    if entry is None:
+        return None
+    store_user_token(session, entry)
+    return entry["access_token"]
+
+
+# Threads of one process exclude each other with these (striped by key, so memory stays
+# bounded), processes with an flock on a per-key file in SPOTIFY_TOKEN_LOCK_DIR
+_thread_locks = [threading.Lock() for _ in range(64)]
+
+
+def lock_path(key):
+    lock_dir = getattr(settings, "SPOTIFY_TOKEN_LOCK_DIR", None) or os.path.join(
+        tempfile.gettempdir(), "emosion-spotify-locks")
+    return os.path.join(lock_dir, key.replace(":", "-") + ".lock")
+
+
+@contextmanager
+def refresh_lock(key):
+    """
+    Hold the refresh lock for `key`. After SPOTIFY_TOKEN_LOCK_TIMEOUT seconds the caller
+    goes ahead without it, so a hung holder delays refreshes but cannot block them.
+    """
+    timeout = getattr(settings, "SPOTIFY_TOKEN_LOCK_TIMEOUT", 10)
+    deadline = time.monotonic() + timeout
+    thread_lock = _thread_locks[hash(key) % len(_thread_locks)]
+    locked = thread_lock.acquire(timeout=timeout)
+    lock_file = None
+    try:
+        if fcntl is not None:
+            path = lock_path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            lock_file = open(path, "a")
+            while True:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if time.monotonic() > deadline:
+                        break
+                    time.sleep(0.05)
+        yield
+    finally:
+        if lock_file is not None:
+            lock_file.close()  # releases the flock
+        if locked:
+            thread_lock.release()
+
+
+def _request_refresh(refresh_token):
+    data = {"grant_type": "refresh_token", "refresh_token": refresh_token}
+    try:
+        response = spotify_http.get_client().token_request(urlencode(data), basic_auth_header())
+    except requests.RequestException:
+        logger.exception("Spotify token refresh failed")
+        return None
+    if response.status_code != 200:
+        return None
+    token_info = response.json()
+    return {
+        "access_token": token_info["access_token"],
+        "refresh_token": token_info.get("refresh_token") or refresh_token,
+        "expires_at": time.time() + token_info.get("expires_in", 3600),
+    }
+
+
+# ===================== App (client credentials) token =====================
+
+class DjangoCacheHandler(CacheHandler):
+    """
+    spotipy cache handler backed by a Django cache alias, so every worker process shares
+    one client-credentials token instead of each fetching its own. spotipy itself
+    refreshes the token shortly before `expires_at`.
+    """
+    def __init__(self, alias=CACHE_ALIAS, key="client_credentials"):
+        self.alias = alias
+        self.key = key
+
+    def get_cached_token(self):
+        return caches[self.alias].get(self.key)
+
+    def save_token_to_cache(self, token_info):
+        timeout = max(int(token_info.get("expires_at", 0) - time.time()), 1)
+        caches[self.alias].set(self.key, token_info, timeout=timeout)
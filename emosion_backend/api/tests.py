@@ -1,3 +1,721 @@
-from django.test import TestCase
+import base64
+import importlib.util
+import io
+import json
+import os
+import tempfile
+import time
+from unittest import skipUnless
 
-# Create your tests here.
+import numpy as np
+import torch
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+
+from . import jobs, mood_model
+
+
+class InferenceBackendParityTests(SimpleTestCase):
+    """Exported TorchScript / ONNX models must give the same logits and classes as eager PyTorch."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.ts_path = os.path.join(cls.tmp.name, "mood_cnn.ts")
+        cls.onnx_path = os.path.join(cls.tmp.name, "mood_cnn.onnx")
+        call_command(
+            "export_mood_model", torchscript=cls.ts_path, onnx=cls.onnx_path,
+            skip_onnx=importlib.util.find_spec("onnx") is None, stdout=io.StringIO(),
+        )
+        cls.eager, cls.eager_classes = mood_model.load_eager()
+        cls.inputs = torch.rand(4, 1, 48, 48, generator=torch.Generator().manual_seed(0)) * 2 - 1
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+        super().tearDownClass()
+
+    def assert_parity(self, model, idx_to_class):
+        with torch.no_grad():
+            expected = self.eager(self.inputs.to(mood_model.device)).cpu()
+            actual = model(self.inputs.to(mood_model.device)).cpu()
+        self.assertEqual(idx_to_class, self.eager_classes)
+        torch.testing.assert_close(actual, expected, rtol=1e-4, atol=1e-5)
+        self.assertTrue(torch.equal(actual.argmax(dim=1), expected.argmax(dim=1)))
+
+    def test_torchscript_matches_eager(self):
+        with override_settings(MOOD_MODEL_TORCHSCRIPT_PATH=self.ts_path):
+            self.assert_parity(*mood_model.load_torchscript())
+
+    @skipUnless(importlib.util.find_spec("onnxruntime") and importlib.util.find_spec("onnx"),
+                "onnx/onnxruntime not installed")
+    def test_onnx_matches_eager(self):
+        with override_settings(MOOD_MODEL_ONNX_PATH=self.onnx_path):
+            self.assert_parity(*mood_model.load_onnx())
+
+    def test_int8_backend_loads_and_tracks_eager(self):
+        checkpoint = torch.load(mood_model._checkpoint_path(), map_location="cpu")
+        quantized, engine = mood_model.quantize_static(
+            checkpoint["model_state_dict"], len(checkpoint["class_to_idx"]), [self.inputs]
+        )
+        path = os.path.join(self.tmp.name, "mood_cnn.int8.ts")
+        scripted = torch.jit.trace(quantized, self.inputs[:1])
+        torch.jit.save(scripted, path, _extra_files={"class_to_idx.json": json.dumps(checkpoint["class_to_idx"]),
+                                                     "quant_engine": engine})
+
+        with override_settings(MOOD_MODEL_INT8_PATH=path):
+            model, idx_to_class = mood_model.load_int8()
+        with torch.no_grad():
+            expected = self.eager(self.inputs.to(mood_model.device)).cpu()
+            actual = model(self.inputs)
+        self.assertEqual(idx_to_class, self.eager_classes)
+        self.assertEqual(actual.shape, expected.shape)
+        torch.testing.assert_close(actual, expected, rtol=0, atol=0.25)
+
+
+class MicroBatcherTests(SimpleTestCase):
+    def test_concurrent_requests_are_batched_and_routed_back(self):
+        from .batching import MicroBatcher
+
+        seen_sizes = []
+
+        def predict_fn(batch):
+            seen_sizes.append(len(batch))
+            return [float(row.sum()) for row in batch]
+
+        batcher = MicroBatcher(predict_fn, max_batch_size=8, max_wait_ms=50)
+        futures = [batcher.submit(torch.full((1, 1, 2, 2), float(i))) for i in range(8)]
+
+        self.assertEqual([f.result(timeout=5) for f in futures], [4.0 * i for i in range(8)])
+        self.assertEqual(seen_sizes, [8])
+        self.assertEqual(batcher.stats()["batch_size_histogram"], {"8": 1})
+
+    def test_errors_reach_every_waiting_request(self):
+        from .batching import MicroBatcher
+
+        def predict_fn(batch):
+            raise RuntimeError("boom")
+
+        batcher = MicroBatcher(predict_fn, max_batch_size=2, max_wait_ms=50)
+        futures = [batcher.submit(torch.zeros(1, 2, 2)) for _ in range(2)]
+        for future in futures:
+            with self.assertRaises(RuntimeError):
+                future.result(timeout=5)
+
+    def test_cancelled_request_does_not_stop_the_batcher(self):
+        import asyncio
+        import threading
+        from .batching import MicroBatcher
+
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def predict_fn(batch):
+            release.wait(5)
+            return [float(row.sum()) for row in batch]
+
+        batcher = MicroBatcher(predict_fn, max_batch_size=1, max_wait_ms=0)
+        busy = batcher.submit(torch.zeros(1, 2, 2))
+
+        async def cancel_while_queued():
+            # What Django does to the view task when the client disconnects
+            task = asyncio.ensure_future(asyncio.wrap_future(batcher.submit(torch.ones(1, 2, 2))))
+            await asyncio.sleep(0)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(cancel_while_queued())
+        release.set()
+
+        self.assertEqual(busy.result(timeout=5), 0.0)
+        self.assertEqual(batcher.submit(torch.full((1, 2, 2), 2.0)).result(timeout=5), 8.0)
+
+
+def png_upload(name, value):
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new("L", (64, 64), color=value).save(buffer, format="PNG")
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type="image/png")
+
+
+class PreprocessBytesTests(SimpleTestCase):
+    def test_matches_inference_transform(self):
+        from PIL import Image
+
+        rng = np.random.default_rng(0)
+        img = Image.fromarray(rng.integers(0, 256, (120, 90, 3), dtype=np.uint8))
+        buffer = io.BytesIO()
+        img.save(buffer, format="PNG")
+
+        expected = mood_model.inference_transform(img).unsqueeze(0)
+        actual = mood_model.preprocess_bytes(buffer.getvalue())
+        self.assertEqual(actual.shape, (1, 1, 48, 48))
+        self.assertTrue(torch.allclose(actual, expected, atol=1e-5))
+
+    def test_jpeg_draft_decode_stays_close(self):
+        from PIL import Image
+
+        gradient = np.add.outer(np.arange(480), np.arange(640)) % 256
+        img = Image.fromarray(gradient.astype(np.uint8)).convert("RGB")
+        buffer = io.BytesIO()
+        img.save(buffer, format="JPEG", quality=95)
+
+        expected = mood_model.inference_transform(Image.open(io.BytesIO(buffer.getvalue()))).unsqueeze(0)
+        actual = mood_model.preprocess_bytes(buffer.getvalue())
+        self.assertLess((actual - expected).abs().mean().item(), 0.05)
+
+
+class UploadTestCase(SimpleTestCase):
+    """Uploads go to a throwaway MEDIA_ROOT and start with an empty prediction cache."""
+    def setUp(self):
+        from django.core.cache import caches
+
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=self.media.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        caches["predictions"].clear()
+
+    def stored_uploads(self):
+        jobs.get_queue().wait(timeout=5)
+        return sorted(os.listdir(os.path.join(self.media.name, "uploads")))
+
+
+class PredictManyTests(UploadTestCase):
+
+    def test_one_forward_and_one_recommendation_fetch_per_mood(self):
+        from unittest import mock
+
+        uploads = [png_upload("a.png", 10), png_upload("b.png", 200), png_upload("c.png", 10)]
+        with mock.patch("api.mood_model.predict_batch", wraps=mood_model.predict_batch) as predict_batch, \
+                mock.patch("api.views.recommend_song_for_mood", return_value=[]) as recommend:
+            response = self.client.post("/api/predict/batch/", {"images": uploads})
+
+        self.assertEqual(response.status_code, 200)
+        results = response.json()["results"]
+        self.assertEqual([r["name"] for r in results], ["a.png", "b.png", "c.png"])
+        self.assertTrue(all("mood" in r and "image_url" in r for r in results))
+        self.assertEqual(predict_batch.call_count, 1)
+        self.assertEqual(predict_batch.call_args[0][0].shape, (3, 1, 48, 48))
+
+        moods = {r["mood"] for r in results}
+        self.assertEqual(recommend.call_count, len(moods))
+        self.assertEqual(set(response.json()["recommendations"]), moods)
+
+    def test_failed_persist_keeps_results_aligned(self):
+        from unittest import mock
+        from .prediction_cache import persist_content_addressed
+
+        def persist(data, name, digest):
+            if name == "b.png":
+                raise OSError("storage unavailable")
+            return persist_content_addressed(data, name, digest)
+
+        uploads = [png_upload("a.png", 10), png_upload("b.png", 200), png_upload("c.png", 250)]
+        expected = [mood_model.predict_one(mood_model.preprocess_bytes(u.read())) for u in uploads]
+        for upload in uploads:
+            upload.seek(0)
+        with mock.patch("api.views.persist_content_addressed", side_effect=persist), \
+                mock.patch("api.views.recommend_song_for_mood", return_value=[]):
+            results = self.client.post("/api/predict/batch/", {"images": uploads}).json()["results"]
+
+        self.assertEqual(results[1], {"name": "b.png", "error": "Image could not be processed"})
+        for result, (mood, confidence) in zip([results[0], results[2]], [expected[0], expected[2]]):
+            self.assertEqual(result["mood"], mood)
+            self.assertAlmostEqual(result["confidence"], confidence, places=5)
+
+    def test_requires_images(self):
+        self.assertEqual(self.client.post("/api/predict/batch/", {}).status_code, 400)
+
+
+class PredictionCacheTests(UploadTestCase):
+    def test_duplicate_upload_skips_inference_and_storage(self):
+        from unittest import mock
+
+        with mock.patch("api.mood_model.predict_one", wraps=mood_model.predict_one) as predict_one, \
+                mock.patch("api.views.recommend_song_for_mood", return_value=[]):
+            first = self.client.post("/api/predict/", {"image": png_upload("emma.jpg", 90)}).json()
+            second = self.client.post("/api/predict/", {"image": png_upload("emma.jpg", 90)}).json()
+            other = self.client.post("/api/predict/", {"image": png_upload("emma.jpg", 30)}).json()
+
+        self.assertEqual(predict_one.call_count, 2)
+        self.assertEqual((first["mood"], first["confidence"], first["image_url"]),
+                         (second["mood"], second["confidence"], second["image_url"]))
+        self.assertNotEqual(first["image_url"], other["image_url"])
+        self.assertEqual(len(self.stored_uploads()), 2)
+
+    def test_cache_hit_does_not_load_the_model(self):
+        from unittest import mock
+
+        with mock.patch("api.views.recommend_song_for_mood", return_value=[]):
+            self.client.post("/api/predict/", {"image": png_upload("hit.png", 70)})
+            with mock.patch.object(mood_model, "_model", None), \
+                    mock.patch("api.mood_model._load_model", side_effect=AssertionError("model loaded")):
+                hit = self.client.post("/api/predict/", {"image": png_upload("hit.png", 70)})
+                many = self.client.post("/api/predict/batch/", {"images": [png_upload("hit.png", 70)]})
+
+        self.assertEqual(hit.status_code, 200)
+        self.assertIn("mood", many.json()["results"][0])
+
+    def test_cache_hit_stores_an_upload_whose_write_failed(self):
+        from unittest import mock
+
+        with mock.patch("api.views.recommend_song_for_mood", return_value=[]):
+            with mock.patch("api.jobs.store_upload", side_effect=OSError("disk full")):
+                first = self.client.post("/api/predict/", {"image": png_upload("lost.png", 60)}).json()
+                jobs.get_queue().wait(timeout=5)
+            self.assertEqual(self.client.get(f"/api/jobs/{first['job_id']}/").json()["status"], "failed")
+            second = self.client.post("/api/predict/", {"image": png_upload("lost.png", 60)}).json()
+
+        self.assertEqual(second["image_url"], first["image_url"])
+        self.assertEqual(self.stored_uploads(), [first["image_url"].rsplit("/", 1)[-1]])
+
+    def test_concurrent_jobs_for_the_same_bytes_store_one_copy(self):
+        from .prediction_cache import content_digest, persist_content_addressed
+
+        data = png_upload("same.png", 50).read()
+        for _ in range(4):
+            persist_content_addressed(data, "same.png", content_digest(data))
+
+        self.assertEqual(self.stored_uploads(), [content_digest(data) + ".png"])
+        self.assertEqual(os.listdir(os.path.join(self.media.name, "thumbnails")), [content_digest(data) + ".jpg"])
+
+    def test_undecodable_upload_is_rejected(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        upload = SimpleUploadedFile("broken.jpg", b"not an image", content_type="image/jpeg")
+        response = self.client.post("/api/predict/", {"image": upload})
+        self.assertEqual(response.status_code, 400)
+        jobs.get_queue().wait(timeout=5)
+        self.assertFalse(os.path.exists(os.path.join(self.media.name, "uploads")))
+
+    def test_upload_is_stored_with_thumbnail_by_background_job(self):
+        from unittest import mock
+
+        with mock.patch("api.views.recommend_song_for_mood", return_value=[]):
+            body = self.client.post("/api/predict/", {"image": png_upload("face.png", 120)}).json()
+
+        self.assertEqual(len(self.stored_uploads()), 1)
+        status = self.client.get(f"/api/jobs/{body['job_id']}/").json()
+        self.assertEqual(status["status"], "done")
+        self.assertTrue(os.path.exists(os.path.join(self.media.name, status["result"]["thumbnail"])))
+        self.assertEqual(self.client.get("/api/jobs/unknown/").status_code, 404)
+
+
+class RecommendationDeadlineTests(UploadTestCase):
+    @override_settings(MOOD_RECOMMENDATION_DEADLINE_MS=50)
+    def test_slow_spotify_returns_cached_recommendations(self):
+        import threading
+        from unittest import mock
+
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def slow(mood):
+            release.wait(5)
+            return [{"spotify_id": "live"}]
+
+        with mock.patch("api.views.recommend_song_for_mood", side_effect=slow), \
+                mock.patch("api.views.cached_recommendations", return_value=[{"spotify_id": "cached"}]):
+            start = time.perf_counter()
+            body = self.client.post("/api/predict/", {"image": png_upload("slow.png", 40)}).json()
+            elapsed = time.perf_counter() - start
+
+        self.assertLess(elapsed, 2)
+        self.assertFalse(body["recommendations_complete"])
+        self.assertEqual(body["recommendations"], [{"spotify_id": "cached"}])
+        self.assertIn("mood", body)
+
+    @override_settings(MOOD_RECOMMENDATION_DEADLINE_MS=20)
+    def test_one_fetch_in_flight_per_playlist(self):
+        import threading
+        from unittest import mock
+        from .views import recommendations_within_deadline
+
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def slow(mood):
+            release.wait(5)
+            return [{"spotify_id": "live"}]
+
+        with mock.patch("api.views.recommend_song_for_mood", side_effect=slow) as recommend, \
+                mock.patch("api.views.cached_recommendations", return_value=[]):
+            for _ in range(5):
+                self.assertEqual(recommendations_within_deadline(["sad"]), ({"sad": []}, False))
+            self.assertEqual(recommend.call_count, 1)
+
+            release.set()
+            with override_settings(MOOD_RECOMMENDATION_DEADLINE_MS=0):
+                self.assertEqual(recommendations_within_deadline(["sad"])[0], {"sad": [{"spotify_id": "live"}]})
+        self.assertLessEqual(recommend.call_count, 2)
+
+
+class CanvasJobTests(UploadTestCase, TransactionTestCase):
+    def test_canvas_is_written_in_background(self):
+        from .models import Post, User
+
+        user = User.objects.create_user(username="ada", email="ada@example.com", password="pw")
+        post = Post.objects.create(user=user, image_path="")
+        canvas = "data:image/png;base64," + base64.b64encode(png_upload("c.png", 0).read()).decode()
+
+        response = self.client.post("/api/save_canvas/", {"post_id": post.id, "canvas_image": canvas},
+                                    content_type="application/json")
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json()["job_id"]
+        self.assertEqual(response.json()["status_url"], f"/api/jobs/{job_id}/")
+        jobs.get_queue().wait(timeout=5)
+
+        self.assertEqual(self.client.get(response.json()["status_url"]).json()["status"], "done")
+        post.refresh_from_db()
+        self.assertEqual(post.canvas_image.name, f"canvas_drawings/canvas_{post.id}.png")
+
+    def test_rejects_malformed_canvas(self):
+        from .models import Post, User
+
+        user = User.objects.create_user(username="bob", email="bob@example.com", password="pw")
+        post = Post.objects.create(user=user, image_path="")
+        response = self.client.post("/api/save_canvas/", {"post_id": post.id, "canvas_image": "not a data url"},
+                                    content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+
+
+class AsyncViewTests(UploadTestCase):
+    async def test_predict_async_matches_sync_predict(self):
+        from unittest import mock
+
+        with mock.patch("api.views.recommend_song_for_mood", return_value=[]), \
+                mock.patch("api.views.recommend_song_for_mood_async", return_value=[]) as recommend:
+            sync_body = (await sync_to_async(self.client.post)("/api/predict/", {"image": png_upload("s.png", 70)})).json()
+            caches["predictions"].clear()
+            response = await self.async_client.post("/api/predict/async/", {"image": png_upload("a.png", 70)})
+
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual((body["mood"], body["confidence"]), (sync_body["mood"], sync_body["confidence"]))
+        recommend.assert_awaited_once_with(body["mood"])
+
+
+def playlist_page(*ids):
+    return {"items": [{"track": {"id": i, "name": i, "artists": [], "album": {"images": [{"url": "c"}]},
+                                 "external_urls": {"spotify": "u"}, "preview_url": None}} for i in ids]}
+
+
+class InlineExecutor:
+    def submit(self, fn, *args):
+        fn(*args)
+
+
+class PlaylistCacheTests(TestCase):
+    def setUp(self):
+        from unittest import mock
+
+        caches["playlists"].clear()
+        patcher = mock.patch("api.spotify_reco._refresh_executor", InlineExecutor())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_fresh_entry_is_served_without_calling_spotify(self):
+        from unittest import mock
+        from .spotify_reco import recommend_song_for_mood
+
+        with mock.patch("api.spotify_reco.sp.playlist_items", return_value=playlist_page("a", "b")) as items:
+            recommend_song_for_mood("happy")
+            recs = recommend_song_for_mood("happy", num_tracks=2)
+
+        self.assertEqual(items.call_count, 1)
+        self.assertEqual(sorted(r["spotify_id"] for r in recs), ["a", "b"])
+
+    def test_stale_entry_is_served_while_refreshing(self):
+        from unittest import mock
+        from .spotify_reco import recommend_song_for_mood, get_playlist_tracks, MOOD_PLAYLISTS
+
+        with mock.patch("api.spotify_reco.sp.playlist_items", return_value=playlist_page("old")):
+            recommend_song_for_mood("sad")
+        with override_settings(SPOTIFY_PLAYLIST_TTL=-1), \
+                mock.patch("api.spotify_reco.sp.playlist_items", return_value=playlist_page("new")):
+            stale = recommend_song_for_mood("sad")
+        self.assertEqual([r["spotify_id"] for r in stale], ["old"])
+        self.assertEqual([t["spotify_id"] for t in get_playlist_tracks(MOOD_PLAYLISTS["sad"])], ["new"])
+
+    def test_spotify_outage_keeps_stale_tracks(self):
+        from unittest import mock
+        from .spotify_reco import recommend_song_for_mood
+
+        with mock.patch("api.spotify_reco.sp.playlist_items", return_value=playlist_page("kept")):
+            recommend_song_for_mood("neutral")
+        with override_settings(SPOTIFY_PLAYLIST_TTL=-1), \
+                mock.patch("api.spotify_reco.sp.playlist_items", side_effect=RuntimeError("down")):
+            first = recommend_song_for_mood("neutral")
+            second = recommend_song_for_mood("neutral")
+        self.assertEqual([r["spotify_id"] for r in first + second], ["kept", "kept"])
+
+    async def test_recommendations_fetched_with_async_client(self):
+        import httpx
+        from unittest import mock
+        from .spotify_reco import recommend_song_for_mood_async
+
+        def handler(request):
+            self.assertEqual(request.headers["Authorization"], "Bearer token")
+            track = {"id": "t1", "name": "Song", "artists": [{"name": "Band"}], "album": {"images": [{"url": "c"}]},
+                     "external_urls": {"spotify": "u"}, "preview_url": None}
+            return httpx.Response(200, json={"items": [{"track": track}]})
+
+        with mock.patch("api.spotify_reco.sp.auth_manager.get_access_token", return_value="token"):
+            async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+                recs = await recommend_song_for_mood_async("sad", client=client)
+
+        self.assertEqual([(r["spotify_id"], r["artist"]) for r in recs], [("t1", "Band")])
+
+
+
+class TrackCatalogTests(TestCase):
+    def test_sync_follows_pagination_and_recommendations_use_catalog(self):
+        from unittest import mock
+        from .models import PlaylistTrack, Track
+        from .spotify_reco import MOOD_PLAYLISTS, recommend_song_for_mood
+
+        first = {**playlist_page("a", "b"), "next": "page-2"}
+        second = {**playlist_page("b2", "c"), "next": None}
+        with mock.patch("api.spotify_reco.sp.playlist_items", return_value=first), \
+                mock.patch("api.spotify_reco.sp.next", return_value=second):
+            call_command("sync_track_catalog", "--mood", "happy", stdout=io.StringIO())
+            call_command("sync_track_catalog", "--mood", "happy", stdout=io.StringIO())  # idempotent
+
+        self.assertEqual(Track.objects.count(), 4)
+        self.assertEqual(PlaylistTrack.objects.filter(playlist_id=MOOD_PLAYLISTS["happy"]).count(), 4)
+        self.assertEqual(set(PlaylistTrack.objects.values_list("mood", flat=True)), {"happy"})
+
+        with mock.patch("api.spotify_reco.sp.playlist_items", side_effect=RuntimeError("offline")):
+            recs = recommend_song_for_mood("happy", num_tracks=3)
+        self.assertEqual(len({r["spotify_id"] for r in recs}), 3)
+        self.assertTrue(all(r["url"].startswith("https://open.spotify.com/track/") for r in recs))
+
+    def test_mood_tracks_falls_back_to_spotify_without_a_catalog(self):
+        from unittest import mock
+        from django.db import OperationalError
+        from django.test import RequestFactory
+        from .views import get_random_songs_from_playlist
+
+        request = RequestFactory().get("/api/mood_tracks/")
+        request.session = {}
+        with mock.patch("api.catalog.sample_playlist", side_effect=OperationalError("no such table")), \
+                mock.patch("api.views.spotify_tokens.get_user_token", return_value=None) as get_token:
+            self.assertEqual(get_random_songs_from_playlist(request, "playlist"), [])
+        get_token.assert_called_once()
+
+
+class StubSpotify:
+    """Local HTTP server replaying scripted (status, headers, json) responses in order."""
+    def __init__(self, responses):
+        import http.server
+        import threading
+
+        self.responses = list(responses)
+        self.requests = []
+        stub = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive
+
+            def _reply(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                self.rfile.read(length)
+                stub.requests.append((self.command, self.path, self.client_address[1]))
+                status, headers, payload = stub.responses.pop(0)
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_POST = _reply
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class SpotifyHTTPTests(SimpleTestCase):
+    def setUp(self):
+        caches["spotify_tokens"].clear()
+
+    def stub(self, *responses):
+        from .spotify_http import SpotifyHTTP
+
+        stub = StubSpotify(responses)
+        self.addCleanup(stub.close)
+        client = SpotifyHTTP(api_base=stub.url, accounts_base=stub.url, backoff=0.01)
+        self.addCleanup(client.session.close)
+        return stub, client
+
+    def test_retries_429_with_retry_after_over_one_connection(self):
+        stub, client = self.stub((429, {"Retry-After": "0"}, {}), (200, {}, {"items": []}))
+
+        response = client.api_get("playlists/37i9dQZF1DXdPec7aLTmlC/tracks", "token", params={"limit": 100})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([path for _, path, _ in stub.requests], ["/playlists/37i9dQZF1DXdPec7aLTmlC/tracks?limit=100"] * 2)
+        self.assertEqual(len({port for _, _, port in stub.requests}), 1)
+        stats = client.stats()["GET playlists/{id}/tracks"]
+        self.assertEqual((stats["calls"], stats["retries"], stats["errors"]), (2, 1, 1))
+
+    def test_gives_up_after_max_retries_and_does_not_retry_failed_posts(self):
+        stub, client = self.stub(*[(503, {}, {})] * 3, (503, {}, {}))
+        client.max_retries = 2
+
+        self.assertEqual(client.api_get("me/top/tracks", "token").status_code, 503)
+        self.assertEqual(len(stub.requests), 3)
+        self.assertEqual(client.token_request("grant_type=refresh_token", "abc").status_code, 503)
+        self.assertEqual(len(stub.requests), 4)
+
+    def test_retry_after_past_the_time_budget_returns_the_429(self):
+        stub, client = self.stub((429, {"Retry-After": "5"}, {}), (200, {}, {}))
+        client.time_budget = 1.0
+
+        start = time.perf_counter()
+        response = client.api_get("me/top/tracks", "token")
+
+        self.assertEqual(response.status_code, 429)
+        self.assertLess(time.perf_counter() - start, 1)
+        self.assertEqual(len(stub.requests), 1)
+
+    def test_spotify_api_get_refreshes_expired_token_through_shared_client(self):
+        from unittest import mock
+        from django.test import RequestFactory
+        from .views import spotify_api_get
+
+        stub, client = self.stub((401, {}, {}), (200, {}, {"access_token": "new"}), (200, {}, {"items": [1]}))
+        request = RequestFactory().get("/")
+        request.session = {"spotify_access_token": "old", "spotify_refresh_token": "refresh"}
+        with mock.patch("api.spotify_http._client", client):
+            data = spotify_api_get(request, "me/top/tracks", params={"limit": 10})
+
+        self.assertEqual(data, {"items": [1]})
+        self.assertEqual(request.session["spotify_access_token"], "new")
+        self.assertEqual([(m, p.split("?")[0]) for m, p, _ in stub.requests],
+                         [("GET", "/me/top/tracks"), ("POST", "/api/token"), ("GET", "/me/top/tracks")])
+
+
+class SpotifyTokenTests(SimpleTestCase):
+    def setUp(self):
+        caches["spotify_tokens"].clear()
+        self.addCleanup(caches["spotify_tokens"].clear)
+
+    def request(self, access="old", expires_in=3600):
+        from django.test import RequestFactory
+
+        request = RequestFactory().get("/")
+        request.session = {"spotify_access_token": access, "spotify_refresh_token": "refresh",
+                           "spotify_expires_at": time.time() + expires_in}
+        return request
+
+    def test_refreshes_ahead_of_expiry_only(self):
+        from unittest import mock
+        from .spotify_tokens import get_user_token
+
+        new = {"access_token": "new", "refresh_token": "refresh", "expires_at": time.time() + 3600}
+        with mock.patch("api.spotify_tokens._request_refresh", return_value=new) as refresh:
+            self.assertEqual(get_user_token(self.request(expires_in=3600)), "old")
+            expiring = self.request(expires_in=30)
+            self.assertEqual(get_user_token(expiring), "new")
+        self.assertEqual(refresh.call_count, 1)
+        self.assertEqual(expiring.session["spotify_expires_at"], new["expires_at"])
+
+    def test_concurrent_refreshes_are_single_flight(self):
+        import hashlib
+        import threading
+        from unittest import mock
+        from .spotify_tokens import fcntl, lock_path, refresh_user_token
+
+        lock_held = []
+
+        def slow_refresh(refresh_token):
+            if fcntl is not None:
+                # What another worker process would see: the per-key file is locked
+                with open(lock_path("user:" + hashlib.sha256(refresh_token.encode()).hexdigest())) as f:
+                    try:
+                        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        lock_held.append(False)
+                    except BlockingIOError:
+                        lock_held.append(True)
+            time.sleep(0.2)
+            return {"access_token": "new", "refresh_token": refresh_token, "expires_at": time.time() + 3600}
+
+        requests_ = [self.request(expires_in=0) for _ in range(6)]
+        with mock.patch("api.spotify_tokens._request_refresh", side_effect=slow_refresh) as refresh:
+            threads = [threading.Thread(target=refresh_user_token, args=(r,)) for r in requests_]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+        self.assertEqual(refresh.call_count, 1)
+        self.assertEqual({r.session["spotify_access_token"] for r in requests_}, {"new"})
+        self.assertNotIn(False, lock_held)
+
+    def test_client_credentials_token_is_shared_through_cache(self):
+        from .spotify_tokens import DjangoCacheHandler
+
+        token = {"access_token": "app", "expires_at": int(time.time()) + 3600}
+        DjangoCacheHandler().save_token_to_cache(token)
+        self.assertEqual(DjangoCacheHandler().get_cached_token(), token)
+
+
+class CreatePostTests(TestCase):
+    def setUp(self):
+        from .models import Track, User
+
+        self.user = User.objects.create_user(username="cy", email="cy@example.com", password="pw")
+        Track.objects.create(spotify_id="known", name="Old", artists="A", album="X", duration_ms=1000, genre="pop")
+
+    def post_songs(self, count):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        songs = [{"spotify_id": "known", "name": "New name", "artist": "A", "album": "X", "image_url": "img"}]
+        songs += [{"spotify_id": f"s{count}-{i}", "name": f"Song {i}", "artist": "B", "album": "Y", "image_url": "i"}
+                  for i in range(count)]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post("/api/create_post/", {"user_id": self.user.id, "image": "u", "songs": songs},
+                                        content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+        return response.json(), len(queries)
+
+    def test_query_count_does_not_grow_with_songs(self):
+        from .models import Post, Track
+
+        few, few_queries = self.post_songs(2)
+        many, many_queries = self.post_songs(25)
+
+        self.assertEqual(few_queries, many_queries)
+        self.assertEqual(Post.objects.get(id=many["post_id"]).tracks.count(), 26)
+        self.assertEqual(len(many["saved_tracks"]), 26)
+
+        known = Track.objects.get(spotify_id="known")
+        self.assertEqual((known.name, known.image_url), ("New name", "img"))
+        self.assertEqual((known.duration_ms, known.genre), (1000, "pop"))  # not sent, so kept
+
+
+class QueryPlanAuditTests(TestCase):
+    def test_key_queries_use_indexes(self):
+        out = io.StringIO()
+        call_command("audit_query_plans", stdout=out)
+        self.assertNotIn("FULL SCAN", out.getvalue())
@@ -1,5 +1,5 @@
 from django.urls import path
-from .views import RegisterView, login_view, logout_view, who_am_i, session_view, predict, create_post, save_canvas, get_recommendation, spotify_status, spotify_login, home_top_tracks, mood_tracks, profile_favorites, spotify_callback, debug_session 
+from .views import RegisterView, login_view, logout_view, who_am_i, session_view, predict, predict_many, predict_stats, predict_async, create_post, save_canvas, job_status, get_recommendation, get_recommendation_async, spotify_status, spotify_stats, spotify_login, home_top_tracks, mood_tracks, profile_favorites, spotify_callback, debug_session 
 
 urlpatterns = [
     path('register/', RegisterView.as_view(), name='register'),
@@ -9,14 +9,20 @@ urlpatterns = [
     path('who_am_i/', who_am_i, name='who_am_i'),
     # path('current_user/', current_user, name='current_user'),
     path('predict/', predict, name='predict'),
+    path('predict/batch/', predict_many, name='predict_many'),
+    path('predict/stats/', predict_stats, name='predict_stats'),
+    path('predict/async/', predict_async, name='predict_async'),
     path('create_post/', create_post, name='create_post'),
     path('save_canvas/', save_canvas, name="save_canvas"),
+    path('jobs/<str:job_id>/', job_status, name='job_status'),
     path('get_recommendation/', get_recommendation), 
+    path('get_recommendation/async/', get_recommendation_async),
 
 
     path('spotify_login/', spotify_login, name='spotify_login'),
     path('spotify_callback/', spotify_callback, name='spotify_callback'),
     path('spotify_status/', spotify_status, name='spotify_status'),    
+    path('spotify_stats/', spotify_stats, name='spotify_stats'),
     path('home_top_tracks/', home_top_tracks),    
     path('mood_tracks/', mood_tracks),    
     path('profile_favorites/', profile_favorites),    
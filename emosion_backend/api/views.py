@@ -1,30 +1,38 @@
 # main/views.py
-import os
+import asyncio
 import random
 import string
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 import base64
+import binascii
 from urllib.parse import urlencode
 import requests
 from django.shortcuts import redirect, render
 from django.conf import settings
 from django.http import JsonResponse
+from asgiref.sync import sync_to_async
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework import generics, status
 from django.contrib.auth import authenticate, login as django_login, logout as django_logout
-from django.views.decorators.csrf import ensure_csrf_cookie
+from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt, ensure_csrf_cookie
+from django.views.decorators.http import require_GET, require_POST
 from django.core.files.storage import default_storage
-from django.core.files.base import ContentFile
-from django.utils import timezone
-from PIL import Image
-import torch
+from django.db import close_old_connections, transaction
 import logging
 import json
 
+from . import catalog, jobs, spotify_http, spotify_tokens
+from .spotify_tokens import get_spotify_client_credentials
 from .models import User, Post, Track, TrackFavorite
 from .serializers import UserSerializer
-from .mood_model import model, device, inference_transform, idx_to_class
-from .spotify_reco import recommend_song_for_mood
+from .spotify_reco import (MOOD_PLAYLIST_MAP, cached_recommendations, playlist_for_mood, recommend_song_for_mood,
+                           recommend_song_for_mood_async)
+from .prediction_cache import (content_digest, get_prediction, persist_content_addressed, set_prediction,
+                               store_content_addressed)
+from .model_files import model_version
 
 logger = logging.getLogger(__name__)
 
@@ -33,42 +41,25 @@ logger = logging.getLogger(__name__)
 def generate_random_string(length=16):
     return ''.join(random.choice(string.ascii_letters + string.digits) for _ in range(length))
 
-def get_spotify_client_credentials():
-    client_id = os.environ.get('SPOTIPY_CLIENT_ID')
-    client_secret = os.environ.get('SPOTIPY_CLIENT_SECRET')
-    if not client_id or not client_secret:
-        raise ValueError("Spotify credentials not set in environment variables")
-    return client_id, client_secret
-
-def refresh_spotify_token(request):
-    refresh_token = request.session.get("spotify_refresh_token")
-    if not refresh_token:
-        return None
-    client_id, client_secret = get_spotify_client_credentials()
-    auth_header = base64.b64encode(f"{client_id}:{client_secret}".encode()).decode()
-    data = {"grant_type": "refresh_token", "refresh_token": refresh_token}
-    headers = {"Authorization": f"Basic {auth_header}", "Content-Type": "application/x-www-form-urlencoded"}
-    response = requests.post("https://accounts.spotify.com/api/token", data=urlencode(data), headers=headers)
-    if response.status_code != 200:
-        return None
-    token_info = response.json()
-    request.session['spotify_access_token'] = token_info['access_token']
-    if 'refresh_token' in token_info:
-        request.session['spotify_refresh_token'] = token_info['refresh_token']
-    return token_info['access_token']
+def refresh_spotify_token(request, stale_token=None):
+    return spotify_tokens.refresh_user_token(request, stale_token=stale_token)
 
 def spotify_api_get(request, endpoint, params=None):
-    access_token = request.session.get('spotify_access_token')
+    # Refreshed ahead of expiry, so the 401 below is only a fallback (e.g. a revoked token)
+    access_token = spotify_tokens.get_user_token(request)
     if not access_token:
         return None
-    headers = {"Authorization": f"Bearer {access_token}"}
-    response = requests.get(f"https://api.spotify.com/v1/{endpoint}", headers=headers, params=params)
-    if response.status_code == 401:  # token expired
-        access_token = refresh_spotify_token(request)
-        if not access_token:
-            return None
-        headers["Authorization"] = f"Bearer {access_token}"
-        response = requests.get(f"https://api.spotify.com/v1/{endpoint}", headers=headers, params=params)
+    client = spotify_http.get_client()
+    try:
+        response = client.api_get(endpoint, access_token, params=params)
+        if response.status_code == 401:  # token expired
+            access_token = refresh_spotify_token(request, stale_token=access_token)
+            if not access_token:
+                return None
+            response = client.api_get(endpoint, access_token, params=params)
+    except requests.RequestException:
+        logger.exception("Spotify request for '%s' failed", endpoint)
+        return None
     if response.status_code != 200:
         return None
     return response.json()
@@ -99,52 +90,173 @@ def spotify_callback(request):
     stored_state = request.session.get('spotify_auth_state')
     if state != stored_state:
         return JsonResponse({"error": "State mismatch"}, status=400)
-    client_id, client_secret = get_spotify_client_credentials()
-    token_url = "https://accounts.spotify.com/api/token"
-    auth_header = base64.b64encode(f"{client_id}:{client_secret}".encode()).decode()
     data = {"grant_type": "authorization_code", "code": code, "redirect_uri": "http://127.0.0.1:8000/api/spotify_callback/"}
-    headers = {"Authorization": f"Basic {auth_header}", "Content-Type": "application/x-www-form-urlencoded"}
-    response = requests.post(token_url, data=urlencode(data), headers=headers)
+    try:
+        response = spotify_http.get_client().token_request(urlencode(data), spotify_tokens.basic_auth_header())
+    except requests.RequestException:
+        logger.exception("Spotify token request failed")
+        return JsonResponse({"error": "Token request failed"}, status=502)
     if response.status_code != 200:
         return JsonResponse({"error": "Token request failed", "details": response.text}, status=400)
-    token_info = response.json()
-    request.session['spotify_access_token'] = token_info['access_token']
-    request.session['spotify_refresh_token'] = token_info.get('refresh_token')
+    spotify_tokens.store_user_token(request.session, response.json())
     request.session['spotify_connected'] = True
     return redirect("http://localhost:5173/")
 
 def spotify_status(request):
     return JsonResponse({"connected": bool(request.session.get('spotify_connected', False))})
 
+@api_view(['GET'])
+def spotify_stats(request):
+    """Per-endpoint call counts, retries and latency of the shared Spotify HTTP client."""
+    return Response(spotify_http.get_client().stats())
+
 # ===================== Mood Detection & Recommendation =====================
 
+_recommend_executor = ThreadPoolExecutor(max_workers=getattr(settings, "MOOD_RECOMMENDATION_WORKERS", 8),
+                                         thread_name_prefix="recommend")
+# playlist id -> the fetch in flight for it; later requests wait on that one instead of queueing their own
+_recommend_inflight = {}
+_recommend_inflight_lock = threading.Lock()
+
+def _fetch_recommendations(mood):
+    try:
+        return recommend_song_for_mood(mood)
+    finally:
+        close_old_connections()  # the catalog is queried from this pool thread
+
+def _recommendation_future(mood):
+    playlist_id = playlist_for_mood(mood)
+    with _recommend_inflight_lock:
+        future = _recommend_inflight.get(playlist_id)
+        if future is not None:
+            return future
+        future = _recommend_executor.submit(_fetch_recommendations, mood)
+        _recommend_inflight[playlist_id] = future
+
+    def forget(done):
+        with _recommend_inflight_lock:
+            if _recommend_inflight.get(playlist_id) is done:
+                del _recommend_inflight[playlist_id]
+
+    future.add_done_callback(forget)  # outside the lock: runs right here if already done
+    return future
+
+def recommendations_within_deadline(moods):
+    """
+    Fetch recommendations for every mood concurrently and wait at most
+    MOOD_RECOMMENDATION_DEADLINE_MS (0 = no deadline). Moods still pending get whatever
+    the catalog or playlist cache holds; their fetch keeps running and fills the cache
+    for later requests. Returns ({mood: recommendations}, complete).
+    """
+    deadline_ms = getattr(settings, "MOOD_RECOMMENDATION_DEADLINE_MS", 0)
+    futures = {mood: _recommendation_future(mood) for mood in moods}
+    done, _ = wait(futures.values(), timeout=deadline_ms / 1000 if deadline_ms else None)
+    recommendations, complete = {}, True
+    for mood, future in futures.items():
+        if future in done:
+            recommendations[mood] = future.result()
+        else:
+            logger.warning("Recommendations for '%s' missed the %d ms deadline", mood, deadline_ms)
+            recommendations[mood] = cached_recommendations(mood)
+            complete = False
+    return recommendations, complete
+
 @api_view(['POST'])
 def predict(request):
     image = request.FILES.get("image")
     if not image:
         return Response({"error": "No image provided"}, status=400)
-    try:
-        timestamp = timezone.now().strftime("%Y%m%d_%H%M%S")
-        safe_name = f"{timestamp}_{image.name}"
-        saved_name = default_storage.save(f"uploads/{safe_name}", ContentFile(image.read()))
-        image_url = default_storage.url(saved_name)
-    except Exception:
-        return Response({"error": "Image save failed"}, status=500)
 
+    # Read the upload exactly once; hashing, decoding and storing all share this buffer
+    data = image.read()
+
+    # Same bytes + same model -> same answer: skip inference and just re-check storage
+    digest = content_digest(data)
+    version = model_version()
+    cached = get_prediction(digest, version)
+    if cached:
+        job_id = store_content_addressed(data, cached["saved_name"])
+        recommendations, complete = recommendations_within_deadline([cached["mood"]])
+        return Response({"mood": cached["mood"], "confidence": cached["confidence"],
+                         "recommendations": recommendations[cached["mood"]], "recommendations_complete": complete,
+                         "image_url": default_storage.url(cached["saved_name"]), "job_id": job_id})
+
+    # Imported here so torch and the checkpoint only load in processes that run inference
+    from .mood_model import predict_one, preprocess_bytes
+
+    # Persistence runs on the job queue alongside decoding and inference; the name (and
+    # URL) only depends on the bytes, and the job stores nothing if they are not an image
+    saved_name, image_url, job_id = persist_content_addressed(data, image.name, digest)
     try:
-        img = Image.open(image).convert("L")
+        img_tensor = preprocess_bytes(data)
     except Exception:
-        img = Image.open(default_storage.open(saved_name)).convert("L")
-
-    img_tensor = inference_transform(img).unsqueeze(0).to(device)
-    with torch.no_grad():
-        output = model(img_tensor)
-        probs = torch.softmax(output, dim=1)
-        pred_idx = torch.argmax(probs, dim=1).item()
-        confidence = float(probs[0, pred_idx].cpu().item())
-    mood = idx_to_class.get(pred_idx, "neutral")
-    recommendations = recommend_song_for_mood(mood)
-    return Response({"mood": mood, "confidence": confidence, "recommendations": recommendations, "image_url": image_url})
+        return Response({"error": "Invalid image"}, status=400)
+
+    mood, confidence = predict_one(img_tensor)
+    set_prediction(digest, version, mood, confidence, saved_name)
+    recommendations, complete = recommendations_within_deadline([mood])
+    return Response({"mood": mood, "confidence": confidence, "recommendations": recommendations[mood],
+                     "recommendations_complete": complete, "image_url": image_url, "job_id": job_id})
+
+@api_view(['POST'])
+def predict_many(request):
+    """
+    Several `images` in one multipart request: one forward pass for the images not already
+    in the prediction cache and one recommendation fetch per distinct mood. Images that
+    fail to decode get an "error" entry instead of failing the request.
+    """
+    images = request.FILES.getlist("images") or request.FILES.getlist("image")
+    if not images:
+        return Response({"error": "No images provided"}, status=400)
+    max_images = getattr(settings, "MOOD_PREDICT_MAX_IMAGES", 32)
+    if len(images) > max_images:
+        return Response({"error": f"At most {max_images} images per request"}, status=400)
+
+    version = model_version()
+    results, pending, tensors = [], [], []
+    for image in images:
+        entry = {"name": image.name}
+        results.append(entry)
+        try:
+            data = image.read()
+            digest = content_digest(data)
+            cached = get_prediction(digest, version)
+            if cached:
+                entry.update(mood=cached["mood"], confidence=cached["confidence"],
+                             image_url=default_storage.url(cached["saved_name"]),
+                             job_id=store_content_addressed(data, cached["saved_name"]))
+                continue
+            from .mood_model import preprocess_bytes
+            tensor = preprocess_bytes(data)
+            saved_name, image_url, job_id = persist_content_addressed(data, image.name, digest)
+            # Only now that nothing else can fail, so tensors[i] always belongs to pending[i]
+            tensors.append(tensor)
+            pending.append((entry, digest, saved_name))
+            entry.update(image_url=image_url, job_id=job_id)
+        except Exception:
+            logger.exception("Could not process uploaded image '%s'", image.name)
+            entry["error"] = "Image could not be processed"
+
+    if tensors:
+        import torch
+        from .mood_model import predict_batch
+
+        for (entry, digest, saved_name), (mood, confidence) in zip(pending, predict_batch(torch.cat(tensors))):
+            entry["mood"] = mood
+            entry["confidence"] = confidence
+            set_prediction(digest, version, mood, confidence, saved_name)
+
+    moods = sorted({entry["mood"] for entry in results if "mood" in entry})
+    recommendations, complete = recommendations_within_deadline(moods)
+    return Response({"results": results, "recommendations": recommendations, "recommendations_complete": complete})
+
+@api_view(['GET'])
+def predict_stats(request):
+    from .mood_model import get_batcher
+    batcher = get_batcher()
+    if batcher is None:
+        return Response({"batching": False})
+    return Response({"batching": True, **batcher.stats()})
 
 @api_view(['GET'])
 def get_recommendation(request):
@@ -154,40 +266,119 @@ def get_recommendation(request):
     recommendations = recommend_song_for_mood(mood)
     return JsonResponse({"recommendations": recommendations})
 
+# ===================== Async (ASGI) =====================
+# Plain Django async views (DRF's @api_view is sync-only). Under an ASGI server a request
+# waiting on the model or on Spotify yields the event loop instead of holding a worker.
+
+@csrf_exempt
+@require_POST
+async def predict_async(request):
+    image = request.FILES.get("image")
+    if not image:
+        return JsonResponse({"error": "No image provided"}, status=400)
+
+    loop = asyncio.get_running_loop()
+    data = image.read()
+    digest = content_digest(data)
+    # Hashes the model file on the first request, so keep it off the event loop
+    version = await loop.run_in_executor(None, model_version)
+    cached = get_prediction(digest, version)
+    if cached:
+        job_id = store_content_addressed(data, cached["saved_name"])
+        recommendations, complete = await recommendations_within_deadline_async(cached["mood"])
+        return JsonResponse({"mood": cached["mood"], "confidence": cached["confidence"],
+                             "recommendations": recommendations, "recommendations_complete": complete,
+                             "image_url": default_storage.url(cached["saved_name"]), "job_id": job_id})
+
+    from .mood_model import predict_one_async, preprocess_bytes, get_inference_executor
+
+    executor = get_inference_executor()
+    saved_name, image_url, job_id = persist_content_addressed(data, image.name, digest)
+    try:
+        img_tensor = await loop.run_in_executor(executor, preprocess_bytes, data)
+    except Exception:
+        return JsonResponse({"error": "Invalid image"}, status=400)
+
+    mood, confidence = await predict_one_async(img_tensor)
+    set_prediction(digest, version, mood, confidence, saved_name)
+    recommendations, complete = await recommendations_within_deadline_async(mood)
+    return JsonResponse({"mood": mood, "confidence": confidence, "recommendations": recommendations,
+                         "recommendations_complete": complete, "image_url": image_url, "job_id": job_id})
+
+async def recommendations_within_deadline_async(mood):
+    """Async counterpart of recommendations_within_deadline for a single mood."""
+    deadline_ms = getattr(settings, "MOOD_RECOMMENDATION_DEADLINE_MS", 0)
+    # The task is shielded, so a missed deadline leaves it running to fill the cache
+    task = asyncio.ensure_future(recommend_song_for_mood_async(mood))
+    try:
+        return await asyncio.wait_for(asyncio.shield(task), timeout=deadline_ms / 1000 if deadline_ms else None), True
+    except asyncio.TimeoutError:
+        logger.warning("Recommendations for '%s' missed the %d ms deadline", mood, deadline_ms)
+        return await sync_to_async(cached_recommendations)(mood), False
+
+@require_GET
+async def get_recommendation_async(request):
+    mood = request.GET.get("mood")
+    if not mood:
+        return JsonResponse({"error": "Mood is required, example: /recommend_song_for_mood/?mood=happy"}, status=400)
+    recommendations = await recommend_song_for_mood_async(mood)
+    return JsonResponse({"recommendations": recommendations})
+
 # ===================== Post & Canvas =====================
 
+# create_post song key -> (Track field, value for a new track when the key is missing)
+TRACK_SONG_FIELDS = {
+    "name": ("name", ""),
+    "artist": ("artists", ""),
+    "album": ("album", ""),
+    "duration_ms": ("duration_ms", 0),
+    "image_url": ("image_url", ""),
+    "genre": ("genre", ""),
+}
+
+def upsert_tracks(songs):
+    """
+    Insert or update the Tracks for `songs` with one INSERT ... ON CONFLICT(spotify_id)
+    per distinct set of keys the songs carry, so a key a song leaves out never overwrites
+    what is stored. Returns {spotify_id: track id}.
+    """
+    latest = {}
+    for s in songs:
+        latest[s["spotify_id"]] = s  # a repeated song: its last values win
+    groups = {}
+    for spotify_id, s in latest.items():
+        given = tuple(key for key in TRACK_SONG_FIELDS if s.get(key) is not None)
+        groups.setdefault(given, []).append(Track(spotify_id=spotify_id, **{
+            field: s[key] if key in given else default for key, (field, default) in TRACK_SONG_FIELDS.items()
+        }))
+    for given, tracks in groups.items():
+        update_fields = [TRACK_SONG_FIELDS[key][0] for key in given]
+        if update_fields:
+            Track.objects.bulk_create(tracks, update_conflicts=True, unique_fields=["spotify_id"],
+                                      update_fields=update_fields)
+        else:
+            Track.objects.bulk_create(tracks, ignore_conflicts=True)
+    return dict(Track.objects.filter(spotify_id__in=latest).values_list("spotify_id", "id"))
+
 @api_view(['POST'])
 def create_post(request):
     data = request.data
     user_id = data.get("user_id")
     image_url = data.get("image")
-    songs = data.get("songs", [])
+    songs = [s for s in data.get("songs", []) if s.get("spotify_id")]
     try:
         user = User.objects.get(id=user_id)
     except User.DoesNotExist:
         return Response({"error": "User not found"}, status=404)
-    post = Post.objects.create(user=user, image_path=image_url or "")
-    saved_tracks = []
-    for s in songs:
-        spotify_id = s.get("spotify_id")
-        if not spotify_id:
-            continue
-        track_obj, created = Track.objects.get_or_create(
-            spotify_id=spotify_id,
-            defaults={"name": s.get("name",""), "artists": s.get("artist",""), "album": s.get("album",""),
-                      "duration_ms": s.get("duration_ms",0), "image_url": s.get("image_url",""), "genre": s.get("genre","")}
+    # A constant number of queries however many songs the post has
+    with transaction.atomic():
+        post = Post.objects.create(user=user, image_path=image_url or "")
+        track_ids = upsert_tracks(songs)
+        Post.tracks.through.objects.bulk_create(
+            [Post.tracks.through(post_id=post.id, track_id=track_id) for track_id in dict.fromkeys(
+                track_ids[s["spotify_id"]] for s in songs)]
         )
-        if not created:
-            track_obj.name = s.get("name", track_obj.name)
-            track_obj.artists = s.get("artist", track_obj.artists)
-            track_obj.album = s.get("album", track_obj.album)
-            track_obj.duration_ms = s.get("duration_ms", track_obj.duration_ms)
-            track_obj.image_url = s.get("image_url", track_obj.image_url)
-            track_obj.genre = s.get("genre", track_obj.genre)
-            track_obj.save()
-        post.track.add(track_obj)
-        saved_tracks.append(track_obj.spotify_id)
-    post.save()
+    saved_tracks = [s["spotify_id"] for s in songs]
     return Response({"post_id": post.id, "saved_tracks": saved_tracks}, status=201)
 
 @api_view(['POST'])
@@ -200,11 +391,25 @@ def save_canvas(request):
         post = Post.objects.get(id=post_id)
     except Post.DoesNotExist:
         return Response({"error": "Post not found"}, status=404)
-    format, imgstr = canvas_image.split(";base64,")
+    try:
+        format, imgstr = canvas_image.split(";base64,")
+        data = base64.b64decode(imgstr, validate=True)
+    except (ValueError, binascii.Error):
+        return Response({"error": "canvas_image must be a base64 data URL"}, status=400)
     ext = format.split("/")[-1]
     file_name = f"canvas_{post_id}.{ext}"
-    post.canvas_image.save(file_name, ContentFile(base64.b64decode(imgstr)), save=True)
-    return Response({"message": "Canvas saved successfully"})
+    # Validated; the write itself happens on the job queue
+    job_id = jobs.get_queue().submit("canvas", jobs.store_canvas, post.id, file_name, data)
+    status_url = reverse("job_status", args=[job_id])
+    return Response({"message": f"Canvas queued for saving; see {status_url} for its status",
+                     "job_id": job_id, "status_url": status_url}, status=202)
+
+@api_view(['GET'])
+def job_status(request, job_id):
+    record = jobs.get_queue().status(job_id)
+    if record is None:
+        return Response({"error": "Unknown job"}, status=404)
+    return Response(record)
 
 # ===================== User Auth =====================
 
@@ -277,20 +482,28 @@ def home_top_tracks(request):
     return JsonResponse({"tracks": tracks})
 
 
-MOOD_PLAYLIST_MAP = {
-    "happy": "37i9dQZF1DXdPec7aLTmlC",
-    "neutral": "37i9dQZF1DX4WYpdgoIcn6",
-    "sad": "37i9dQZF1DX7qK8ma5wgG1",
-    "surprise": "37i9dQZF1DWVRSukIED0ZB",
-}
-
 def get_random_songs_from_playlist(request, playlist_id, count=5):
-    access_token = request.session.get("spotify_access_token")
+    # Synced playlists are sampled from the local catalog; Spotify is only asked for the rest
+    sampled = catalog.sample_or_empty(playlist_id, count)
+    if sampled:
+        return [{
+            "name": track.name,
+            "artists": catalog.artist_names(track),
+            "album_name": track.album or "Unknown Album",
+            "album_image": track.image_url or "",
+            "duration_min": round(track.duration_ms / 60000, 1),
+            "url": catalog.TRACK_URL.format(spotify_id=track.spotify_id),
+            "preview_url": track.preview_url,
+        } for track in sampled]
+
+    access_token = spotify_tokens.get_user_token(request)
     if not access_token:
         return []
-    headers = {"Authorization": f"Bearer {access_token}"}
-    url = f"https://api.spotify.com/v1/playlists/{playlist_id}/tracks?limit=100"
-    response = requests.get(url, headers=headers)
+    try:
+        response = spotify_http.get_client().api_get(f"playlists/{playlist_id}/tracks", access_token, params={"limit": 100})
+    except requests.RequestException:
+        logger.exception("Spotify playlist '%s' could not be fetched", playlist_id)
+        return []
     if response.status_code != 200:
         return []
     items = response.json().get("items", [])
@@ -14,3 +14,10 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'emosion_backend.settings')
 
 application = get_asgi_application()
+
+# Load the mood model at server start rather than on the first /api/predict/ request
+from django.conf import settings  # noqa: E402
+
+if settings.MOOD_MODEL_WARMUP:
+    from api.mood_model import warm_up  # noqa: E402
+    warm_up()
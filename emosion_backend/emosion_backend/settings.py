@@ -3,6 +3,8 @@ Django settings for emosion_backend project.
 Generated by Django 5.2.7.
 """
 
+import os
+import tempfile
 from pathlib import Path
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -156,3 +158,109 @@ USE_TZ = True
 STATIC_URL = "static/"
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+# -------------------------------------------
+# CACHES
+# -------------------------------------------
+# "predictions" maps (upload sha256, model version) -> mood/confidence so duplicate
+# uploads skip inference. LocMemCache evicts least-recently-used entries past
+# MAX_ENTRIES and expires them after TIMEOUT seconds; it is per process, so point it at
+# a shared backend (file/DB/redis) when running several workers.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "predictions": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "mood-predictions",
+        "TIMEOUT": int(os.environ.get("MOOD_PREDICTION_CACHE_TTL", str(7 * 24 * 3600))),
+        "OPTIONS": {"MAX_ENTRIES": int(os.environ.get("MOOD_PREDICTION_CACHE_SIZE", "10000"))},
+    },
+    # Normalized tracks of each mood playlist (api/spotify_reco.py); per-entry timeouts
+    # come from SPOTIFY_PLAYLIST_TTL / SPOTIFY_PLAYLIST_MAX_STALE below
+    "playlists": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "spotify-playlists",
+    },
+    # Spotify access tokens (api/spotify_tokens.py). File-based so every worker process on
+    # the host shares the app token and per-user refreshes; use redis/memcached across hosts.
+    "spotify_tokens": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.environ.get("SPOTIFY_TOKEN_CACHE_DIR",
+                                   os.path.join(tempfile.gettempdir(), "emosion-spotify-tokens")),
+    },
+}
+
+# -------------------------------------------
+# MOOD MODEL
+# -------------------------------------------
+# Checkpoint is loaded lazily on the first prediction; with warm-up enabled the
+# WSGI/ASGI entry points load it at server start instead.
+MOOD_MODEL_PATH = os.environ.get("MOOD_MODEL_PATH", str(BASE_DIR / "api" / "mood_cnn.pth"))
+MOOD_MODEL_WARMUP = os.environ.get("MOOD_MODEL_WARMUP", "1") == "1"
+# "eager" (PyTorch), "torchscript", "onnx" (ONNX Runtime, CPU) or "int8" (statically
+# quantized, CPU). torchscript/onnx read the files written by `manage.py export_mood_model`,
+# int8 the one written by `manage.py quantize_mood_model`; empty paths default to the
+# .pth name with a .ts / .onnx / .int8.ts suffix.
+MOOD_MODEL_BACKEND = os.environ.get("MOOD_MODEL_BACKEND", "eager")
+MOOD_MODEL_TORCHSCRIPT_PATH = os.environ.get("MOOD_MODEL_TORCHSCRIPT_PATH", "")
+MOOD_MODEL_ONNX_PATH = os.environ.get("MOOD_MODEL_ONNX_PATH", "")
+MOOD_MODEL_INT8_PATH = os.environ.get("MOOD_MODEL_INT8_PATH", "")
+# torch intra-op threads per worker process; 0 keeps torch's default (all cores)
+MOOD_MODEL_THREADS = int(os.environ.get("MOOD_MODEL_THREADS", "0"))
+# Micro-batching for /api/predict/: concurrent requests are stacked into one forward pass
+# of up to MOOD_BATCH_MAX_SIZE images, waiting at most MOOD_BATCH_MAX_WAIT_MS for company.
+# Batch-size metrics are served at /api/predict/stats/.
+MOOD_BATCHING = os.environ.get("MOOD_BATCHING", "0") == "1"
+MOOD_BATCH_MAX_SIZE = int(os.environ.get("MOOD_BATCH_MAX_SIZE", "16"))
+MOOD_BATCH_MAX_WAIT_MS = float(os.environ.get("MOOD_BATCH_MAX_WAIT_MS", "5"))
+# Upper bound on images accepted by /api/predict/batch/ in one request
+MOOD_PREDICT_MAX_IMAGES = int(os.environ.get("MOOD_PREDICT_MAX_IMAGES", "32"))
+# /api/predict/ waits at most this long for recommendations before answering with the
+# mood and whatever the track catalog / playlist cache already holds (0 = wait for Spotify)
+MOOD_RECOMMENDATION_DEADLINE_MS = int(os.environ.get("MOOD_RECOMMENDATION_DEADLINE_MS", "2000"))
+MOOD_RECOMMENDATION_WORKERS = int(os.environ.get("MOOD_RECOMMENDATION_WORKERS", "8"))
+# Threads the async views (/api/predict/async/) use for decoding and inference; bounds
+# how many forward passes one ASGI process runs at once
+MOOD_INFERENCE_WORKERS = int(os.environ.get("MOOD_INFERENCE_WORKERS", "2"))
+# Seconds before a Spotify request from the async views gives up
+SPOTIFY_REQUEST_TIMEOUT = float(os.environ.get("SPOTIFY_REQUEST_TIMEOUT", "20"))
+# Playlist tracks are re-fetched from Spotify once they are older than SPOTIFY_PLAYLIST_TTL
+# seconds; until then (and while a background refresh runs) recommendations are sampled
+# from the cached copy. A copy older than TTL + MAX_STALE is dropped and fetched inline.
+SPOTIFY_PLAYLIST_TTL = int(os.environ.get("SPOTIFY_PLAYLIST_TTL", "3600"))
+SPOTIFY_PLAYLIST_MAX_STALE = int(os.environ.get("SPOTIFY_PLAYLIST_MAX_STALE", str(24 * 3600)))
+
+# -------------------------------------------
+# MEDIA JOBS
+# -------------------------------------------
+# Uploads, canvas images and thumbnails are written by a local background thread pool
+# (api/jobs.py) after the response is sent; GET /api/jobs/<id>/ reports a job's status.
+MEDIA_JOB_WORKERS = int(os.environ.get("MEDIA_JOB_WORKERS", "2"))
+MEDIA_JOB_HISTORY = int(os.environ.get("MEDIA_JOB_HISTORY", "10000"))
+MEDIA_THUMBNAIL_SIZE = int(os.environ.get("MEDIA_THUMBNAIL_SIZE", "128"))
+
+# -------------------------------------------
+# SPOTIFY HTTP
+# -------------------------------------------
+# Shared keep-alive session for the Spotify calls in api/views.py (api/spotify_http.py).
+# 429/5xx responses are retried up to SPOTIFY_MAX_RETRIES times, honoring Retry-After (at
+# most SPOTIFY_MAX_RETRY_AFTER seconds), as long as the wait ends within SPOTIFY_TIME_BUDGET
+# seconds of the call's start; otherwise the 429/5xx is returned.
+# The base URLs can point at a local stub server in tests. Latency per endpoint:
+# /api/spotify_stats/.
+SPOTIFY_API_BASE = os.environ.get("SPOTIFY_API_BASE", "https://api.spotify.com/v1")
+SPOTIFY_ACCOUNTS_BASE = os.environ.get("SPOTIFY_ACCOUNTS_BASE", "https://accounts.spotify.com")
+SPOTIFY_CONNECT_TIMEOUT = float(os.environ.get("SPOTIFY_CONNECT_TIMEOUT", "3.05"))
+SPOTIFY_READ_TIMEOUT = float(os.environ.get("SPOTIFY_READ_TIMEOUT", "10"))
+SPOTIFY_MAX_RETRIES = int(os.environ.get("SPOTIFY_MAX_RETRIES", "3"))
+SPOTIFY_MAX_RETRY_AFTER = float(os.environ.get("SPOTIFY_MAX_RETRY_AFTER", "10"))
+SPOTIFY_TIME_BUDGET = float(os.environ.get("SPOTIFY_TIME_BUDGET", "15"))
+SPOTIFY_POOL_SIZE = int(os.environ.get("SPOTIFY_POOL_SIZE", "10"))
+# User tokens are refreshed this many seconds before they expire; concurrent refreshes of
+# one login wait up to SPOTIFY_TOKEN_LOCK_TIMEOUT seconds for the one in flight
+SPOTIFY_TOKEN_REFRESH_MARGIN = int(os.environ.get("SPOTIFY_TOKEN_REFRESH_MARGIN", "60"))
+SPOTIFY_TOKEN_LOCK_TIMEOUT = int(os.environ.get("SPOTIFY_TOKEN_LOCK_TIMEOUT", "10"))
+# Lock files that keep worker processes on this host from refreshing the same token twice
+SPOTIFY_TOKEN_LOCK_DIR = os.environ.get("SPOTIFY_TOKEN_LOCK_DIR",
+                                        os.path.join(tempfile.gettempdir(), "emosion-spotify-locks"))
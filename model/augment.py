@@ -0,0 +1,84 @@
+import threading
+import numpy as np
+
+
+class BatchAugmenter:
+    """
+    Random flip / small rotation / brightness for a whole (N, C, H, W) batch in one NumPy pass.
+    Same recipe as cnn_layers.augment_image, but every per-sample parameter is drawn
+    from one seeded Generator, so a fixed seed reproduces the exact same batches.
+    Usable directly as the `augment` callable of dataset.BatchLoader, which passes each
+    batch its own Generator seeded from the shuffle RNG, so a batch's augmentation does
+    not depend on worker timing or prefetch depth and a resumed run replays it exactly.
+    """
+    takes_rng = True  # BatchLoader passes a per-batch `rng`
+    def __init__(self, seed=None, p_augment=0.7, p_flip=0.5, p_rotate=0.5, max_angle=15.0,
+                 p_brightness=0.5, brightness_range=(0.8, 1.2)):
+        self.rng = np.random.default_rng(seed)
+        self.p_augment = p_augment
+        self.p_flip = p_flip
+        self.p_rotate = p_rotate
+        self.max_angle = max_angle
+        self.p_brightness = p_brightness
+        self.brightness_range = brightness_range
+        self._lock = threading.Lock()  # Generator is not thread-safe
+
+    def sample_params(self, n, rng=None):
+        """
+        Per-sample (flip mask, rotation angles in degrees, brightness factors), drawn from
+        `rng` if given, otherwise from the augmenter's own Generator.
+        """
+        if rng is not None:
+            return self._draw(rng, n)
+        with self._lock:
+            return self._draw(self.rng, n)
+
+    def _draw(self, rng, n):
+        augment = rng.random(n) < self.p_augment
+        flip = augment & (rng.random(n) < self.p_flip)
+        rotate = augment & (rng.random(n) < self.p_rotate)
+        angles = np.where(rotate, rng.uniform(-self.max_angle, self.max_angle, n), 0.0)
+        brighten = augment & (rng.random(n) < self.p_brightness)
+        factors = np.where(brighten, rng.uniform(*self.brightness_range, n), 1.0)
+        return flip, angles, factors
+
+    def __call__(self, X_batch, y_batch, rng=None):
+        flip, angles, factors = self.sample_params(len(X_batch), rng)
+        X = np.array(X_batch, dtype=np.float32)  # never modify the caller's (possibly memmapped) data
+
+        X[flip] = X[flip, :, :, ::-1]
+
+        rotate = angles != 0
+        if rotate.any():
+            X[rotate] = rotate_batch(X[rotate], angles[rotate])
+
+        X *= factors[:, np.newaxis, np.newaxis, np.newaxis].astype(np.float32)
+        np.clip(X, 0.0, 1.0, out=X)
+        return X, y_batch
+
+
+def rotate_batch(X, angles):
+    """
+    Rotate each (C, H, W) image counter-clockwise by its own angle (degrees) about the
+    centre, nearest-neighbour with black fill - the same mapping as PIL's Image.rotate.
+    """
+    n, _, height, width = X.shape
+    theta = -np.radians(angles)[:, np.newaxis, np.newaxis]
+    cos, sin = np.cos(theta), np.sin(theta)
+
+    # Pixel centres of the output grid relative to the rotation centre
+    cy, cx = height / 2.0, width / 2.0
+    ys = np.arange(height)[np.newaxis, :, np.newaxis] + 0.5 - cy
+    xs = np.arange(width)[np.newaxis, np.newaxis, :] + 0.5 - cx
+
+    # Inverse affine map: where each output pixel samples from in the input
+    src_x = np.floor(cos * xs + sin * ys + cx).astype(np.intp)
+    src_y = np.floor(-sin * xs + cos * ys + cy).astype(np.intp)
+    inside = (src_x >= 0) & (src_x < width) & (src_y >= 0) & (src_y < height)
+    np.clip(src_x, 0, width - 1, out=src_x)
+    np.clip(src_y, 0, height - 1, out=src_y)
+
+    n_idx = np.arange(n)[:, np.newaxis, np.newaxis]
+    rotated = X[n_idx, :, src_y, src_x]  # (N, H, W, C)
+    rotated *= inside[..., np.newaxis]
+    return rotated.transpose(0, 3, 1, 2)
@@ -0,0 +1,161 @@
+import sys
+import json
+import time
+import platform
+import argparse
+import tracemalloc
+import numpy as np
+
+from cnn_layers import ConvolutionalLayer, ReLULayer, MaxPoolingLayer, DenseLayer, ConvReLUPoolBlock, Sequential
+
+
+def unfused_loop_reference(block):
+    """Loop-engine Conv -> ReLU -> MaxPool with the block's weights; returns (model, conv layer)."""
+    conv = ConvolutionalLayer((block.input_channels, block.input_height, block.input_width), block.filter_size,
+                              block.number_of_filters, block.stride, block.padding, engine="loop")
+    conv.filters = block.filters.copy()
+    conv.biases = block.biases.copy()
+    pool = MaxPoolingLayer(block.pool_size, block.pool_stride, engine="loop")
+    return Sequential([conv, ReLULayer(), pool]), conv
+
+
+def mood_cnn_cases():
+    """
+    (name, make_layer(**kwargs), input shape without batch, reference) for every layer of
+    MoodCNN: 1->16->32->64->128 channels at 48/24/12/6 resolution, pooled down to 3.
+    The reference is a loop engine name, a function building the reference from the layer
+    (see unfused_loop_reference), or None for layers without an alternative path.
+    """
+    cases = []
+    channels, size = 1, 48
+    for filters in (16, 32, 64, 128):
+        shape = (channels, size, size)
+        cases.append((f"conv{channels}x{size}->{filters}",
+                      lambda s=shape, f=filters, **kw: ConvolutionalLayer(s, 3, f, padding=1, **kw),
+                      shape, "loop"))
+        cases.append((f"relu{filters}x{size}", lambda: ReLULayer(), (filters, size, size), None))
+        cases.append((f"pool{filters}x{size}",
+                      lambda **kw: MaxPoolingLayer(2, 2, **kw), (filters, size, size), "loop"))
+        cases.append((f"block{channels}x{size}->{filters}",
+                      lambda s=shape, f=filters: ConvReLUPoolBlock(s, 3, f, padding=1), shape,
+                      unfused_loop_reference))
+        channels, size = filters, size // 2
+    cases.append(("dense1152->128", lambda: DenseLayer(1152, 128), (1152,), None))
+    cases.append(("dense128->5", lambda: DenseLayer(128, 5), (128,), None))
+    return cases
+
+
+def _make(make_layer, engine=None):
+    # engine=None -> the layer's default (optimized) path; same seed so weights match
+    np.random.seed(0)
+    return make_layer(engine=engine) if engine else make_layer()
+
+
+def time_layer(layer, x, repeats):
+    """Best-of-`repeats` forward and backward wall time (seconds) and peak traced memory (bytes)."""
+    out = layer.forward(x)
+    d_out = np.random.default_rng(1).standard_normal(out.shape)
+    layer.backward(d_out)  # warm-up
+
+    best_fwd = best_bwd = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        layer.forward(x)
+        mid = time.perf_counter()
+        layer.backward(d_out)
+        end = time.perf_counter()
+        best_fwd = min(best_fwd, mid - start)
+        best_bwd = min(best_bwd, end - mid)
+
+    tracemalloc.start()
+    layer.forward(x)
+    layer.backward(d_out)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best_fwd, best_bwd, peak
+
+
+def check_against_reference(make_layer, shape, reference, batch_size=2):
+    """Max abs difference of forward, input-gradient and parameter gradients vs the loop reference."""
+    x = np.random.default_rng(2).standard_normal((batch_size,) + shape)
+    fast = _make(make_layer)
+    if callable(reference):
+        ref, ref_params = reference(fast)
+    else:
+        ref = ref_params = _make(make_layer, reference)
+    out_fast, out_ref = fast.forward(x), ref.forward(x)
+    d_out = np.random.default_rng(3).standard_normal(out_ref.shape)
+    diffs = [np.abs(out_fast - out_ref).max(), np.abs(fast.backward(d_out) - ref.backward(d_out)).max()]
+    for _, grad_attr in getattr(fast, "trainable", ()):
+        diffs.append(np.abs(getattr(fast, grad_attr) - getattr(ref_params, grad_attr)).max())
+    return float(max(diffs))
+
+
+def run(batch_sizes, repeats, check=True):
+    results = []
+    for name, make_layer, shape, reference in mood_cnn_cases():
+        error = None
+        if check and reference is not None:
+            error = check_against_reference(make_layer, shape, reference)
+        for batch_size in batch_sizes:
+            layer = _make(make_layer)
+            x = np.random.default_rng(0).standard_normal((batch_size,) + shape)
+            fwd, bwd, peak = time_layer(layer, x, repeats)
+            results.append({
+                "layer": name,
+                "batch_size": batch_size,
+                "forward_ms": fwd * 1e3,
+                "backward_ms": bwd * 1e3,
+                "images_per_s": batch_size / (fwd + bwd),
+                "peak_mb": peak / 2**20,
+                "max_abs_error": error,
+            })
+            print(f"{name:<20} batch {batch_size:>4}  fwd {fwd * 1e3:9.3f} ms  bwd {bwd * 1e3:9.3f} ms  "
+                  f"{batch_size / (fwd + bwd):10.1f} img/s  peak {peak / 2**20:7.2f} MB"
+                  + (f"  err {error:.2e}" if error is not None else ""))
+    return results
+
+
+def find_regressions(results, baseline, threshold):
+    """Entries whose throughput dropped by more than `threshold` (fraction) vs the baseline run."""
+    previous = {(r["layer"], r["batch_size"]): r for r in baseline["results"]}
+    regressions = []
+    for r in results:
+        old = previous.get((r["layer"], r["batch_size"]))
+        if old and r["images_per_s"] < old["images_per_s"] * (1 - threshold):
+            regressions.append((r["layer"], r["batch_size"], old["images_per_s"], r["images_per_s"]))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark cnn_layers forward/backward at MoodCNN shapes")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="previous results JSON to compare throughput against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed throughput drop (fraction)")
+    parser.add_argument("--tolerance", type=float, default=1e-8, help="allowed max abs error vs the loop references")
+    parser.add_argument("--no-check", action="store_true", help="skip the (slow) loop-reference comparison")
+    args = parser.parse_args()
+
+    results = run(args.batch_sizes, args.repeats, check=not args.no_check)
+    with open(args.output, "w") as f:
+        json.dump({
+            "meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+                     "numpy": np.__version__, "machine": platform.machine(), "processor": platform.processor()},
+            "results": results,
+        }, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    failed = False
+    mismatched = [r["layer"] for r in results if r["max_abs_error"] is not None and r["max_abs_error"] > args.tolerance]
+    for layer in sorted(set(mismatched)):
+        print(f"MISMATCH: {layer} differs from its loop reference")
+        failed = True
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for layer, batch_size, old, new in find_regressions(results, baseline, args.threshold):
+            print(f"REGRESSION: {layer} batch {batch_size}: {old:.1f} -> {new:.1f} img/s")
+            failed = True
+    sys.exit(1 if failed else 0)
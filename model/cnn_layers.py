@@ -5,9 +5,13 @@ from PIL import Image, ImageEnhance
 import matplotlib.pyplot as plt
 from sklearn.metrics import confusion_matrix
 import seaborn as sns
+from augment import BatchAugmenter
 
 class ConvolutionalLayer:
-    def __init__(self, input_shape, filter_size, number_of_filters, stride=1, padding=1):
+    # (parameter attribute, gradient attribute) pairs the optimizers update
+    trainable = (("filters", "dfilters"), ("biases", "dbiases"))
+
+    def __init__(self, input_shape, filter_size, number_of_filters, stride=1, padding=1, engine="im2col"):
         self.input_channels, self.input_height, self.input_width = input_shape
         self.filter_size = filter_size
         self.number_of_filters = number_of_filters
@@ -24,7 +28,88 @@ class ConvolutionalLayer:
         self.filters = np.random.randn(number_of_filters, self.input_channels, filter_size, filter_size) * np.sqrt(2. / self.input_channels)# learnable weights for feature extraction
         self.biases = np.zeros((number_of_filters, ))  # one bias per filter, INITIALIZED zero
 
+        # "im2col" = vectorized patch matrix + matmul, "loop" = reference nested loops
+        if engine not in ("im2col", "loop"):
+            raise ValueError(f"Unknown convolution engine: {engine}")
+        self.engine = engine
+
     def forward(self, input_data):
+        if self.engine == "im2col":
+            return self._forward_im2col(input_data)
+        return self._forward_loop(input_data)
+
+    def backward(self, d_out):
+        """
+        d_out: gradient w.r.t output of conv layer
+        returns: gradient w.r.t input
+        """
+        if self.engine == "im2col":
+            return self._backward_im2col(d_out)
+        return self._backward_loop(d_out)
+
+    def _pad(self, input_data):
+        if self.padding > 0:
+            return np.pad(input_data,
+                          ((0,0), (0,0), (self.padding,self.padding),
+                           (self.padding,self.padding)), mode='constant')
+        return input_data
+
+    def _unpad(self, d_input_padded):
+        if self.padding > 0:
+            return d_input_padded[:, :, self.padding:-self.padding, self.padding:-self.padding]
+        return d_input_padded
+
+    def _forward_im2col(self, input_data):
+        self.input_data = input_data
+        batch_size = input_data.shape[0]
+        self.input_padded = self._pad(input_data)
+        self.cols = self._im2col(self.input_padded)
+        weights = self.filters.reshape(self.number_of_filters, -1)
+
+        conv_output = self.cols @ weights.T + self.biases  # (N*out_h*out_w, F)
+        conv_output = conv_output.reshape(batch_size, self.output_height, self.output_width, self.number_of_filters)
+        return conv_output.transpose(0, 3, 1, 2)
+
+    def _im2col(self, input_padded):
+        # (N, C, out_h, out_w, k, k) strided view of every patch, no copy yet
+        windows = np.lib.stride_tricks.sliding_window_view(
+            input_padded, (self.filter_size, self.filter_size), axis=(2, 3)
+        )[:, :, ::self.stride, ::self.stride]
+        windows = windows[:, :, :self.output_height, :self.output_width]
+
+        # Patch matrix: one row per output position, one column per filter weight
+        return windows.transpose(0, 2, 3, 1, 4, 5).reshape(
+            input_padded.shape[0] * self.output_height * self.output_width, -1
+        )
+
+    def _backward_im2col(self, d_out):
+        return self._backward_cols(d_out, self.cols, self.input_padded.shape)
+
+    def _backward_cols(self, d_out, cols, padded_shape):
+        batch_size = d_out.shape[0]
+        k = self.filter_size
+        d_out_mat = d_out.transpose(0, 2, 3, 1).reshape(-1, self.number_of_filters)  # (N*out_h*out_w, F)
+        weights = self.filters.reshape(self.number_of_filters, -1)
+
+        self.dfilters = (d_out_mat.T @ cols).reshape(self.filters.shape)
+        self.dbiases = d_out_mat.sum(axis=0)
+
+        # Gradient for every patch, then fold (col2im) back onto the padded input.
+        # Only k*k strided adds, each covering the whole batch at once.
+        d_cols = (d_out_mat @ weights).reshape(
+            batch_size, self.output_height, self.output_width, self.input_channels, k, k
+        )
+        d_input_padded = np.zeros(padded_shape, dtype=d_cols.dtype)
+        h_end = self.stride * self.output_height
+        w_end = self.stride * self.output_width
+        for ki in range(k):
+            for kj in range(k):
+                d_input_padded[:, :, ki:ki + h_end:self.stride, kj:kj + w_end:self.stride] += \
+                    d_cols[:, :, :, :, ki, kj].transpose(0, 3, 1, 2)
+
+        return self._unpad(d_input_padded)
+
+    def _forward_loop(self, input_data):
         self.input_data = input_data 
         batch_size, _, _, _ = input_data.shape # unpacking by ignoring all except batch_size
 
@@ -32,12 +117,7 @@ class ConvolutionalLayer:
         conv_output = np.zeros((batch_size, self.number_of_filters, self.output_height, self.output_width))
 
         # Apply padding if needed
-        if self.padding > 0:
-            self.input_padded = np.pad(input_data, 
-                                  ((0,0), (0,0), (self.padding,self.padding), 
-                                   (self.padding,self.padding)), mode='constant')
-        else:
-            self.input_padded = input_data
+        self.input_padded = self._pad(input_data)
 
         # Perform convolution
         for n in range(batch_size): # loop over each image in the batch
@@ -54,11 +134,7 @@ class ConvolutionalLayer:
                         conv_output[n, filter_index, i, j] = np.sum(current_patch * self.filters[filter_index]) + float(self.biases[filter_index])
         return conv_output
     
-    def backward(self, d_out):
-        """
-        d_out: gradient w.r.t output of conv layer
-        returns: gradient w.r.t input
-        """
+    def _backward_loop(self, d_out):
         batch_size, _, _, _ = d_out.shape
         d_input_padded = np.zeros_like(self.input_padded)
         self.dfilters = np.zeros_like(self.filters)
@@ -80,11 +156,7 @@ class ConvolutionalLayer:
                         d_input_padded[n, :, vert_start:vert_end, horiz_start:horiz_end] += d_out[n,f,i,j] * self.filters[f]
         
         # Remove padding
-        if self.padding > 0:
-            d_input = d_input_padded[:, :, self.padding:-self.padding, self.padding:-self.padding]
-        else:
-            d_input = d_input_padded
-        return d_input
+        return self._unpad(d_input_padded)
 
 
 class ReLULayer:
@@ -95,12 +167,76 @@ class ReLULayer:
     def backward(self, d_out):
         return d_out * (self.input > 0)
     
+def max_pool_argmax(input_data, pool_size, stride):
+    """Max pool (N, C, H, W) in one strided pass. Returns (pooled, int8 argmax within each window)."""
+    batch_size, channels, input_height, input_width = input_data.shape
+    output_height = (input_height - pool_size)//stride + 1
+    output_width = (input_width - pool_size)//stride + 1
+
+    # (N, C, out_h, out_w, pool*pool) - every window flattened on the last axis
+    windows = np.lib.stride_tricks.sliding_window_view(
+        input_data, (pool_size, pool_size), axis=(2, 3)
+    )[:, :, ::stride, ::stride][:, :, :output_height, :output_width]
+    windows = windows.reshape(batch_size, channels, output_height, output_width, -1)
+
+    # Only the position of the max inside each window is kept for backward.
+    # Ties go to the first max, so exactly one input receives the gradient.
+    argmax = windows.argmax(axis=-1).astype(np.int8)
+    pooled = np.take_along_axis(windows, argmax[..., np.newaxis].astype(np.intp), axis=-1)[..., 0]
+    return pooled, argmax
+
+
+def max_unpool_argmax(d_out, argmax, input_shape, input_dtype, pool_size, stride):
+    """Route each pooled gradient back to its window's max with one fancy-indexing scatter."""
+    batch, ch, out_h, out_w = d_out.shape
+    d_input = np.zeros(input_shape, dtype=np.result_type(input_dtype, d_out.dtype))
+
+    # Absolute (row, col) in the input of every window's max
+    rows = np.arange(out_h)[:, np.newaxis] * stride + argmax // pool_size
+    cols = np.arange(out_w)[np.newaxis, :] * stride + argmax % pool_size
+    n_idx = np.arange(batch)[:, np.newaxis, np.newaxis, np.newaxis]
+    c_idx = np.arange(ch)[np.newaxis, :, np.newaxis, np.newaxis]
+
+    if stride >= pool_size:
+        # Non-overlapping windows: every target is unique, plain scatter
+        d_input[n_idx, c_idx, rows, cols] = d_out
+    else:
+        np.add.at(d_input, (n_idx, c_idx, rows, cols), d_out)
+    return d_input
+
+
 class MaxPoolingLayer:
-    def __init__(self, pool_size=2, stride=2):
+    def __init__(self, pool_size=2, stride=2, engine="argmax"):
         self.pool_size = pool_size
         self.stride = stride
 
+        # "argmax" = one-pass strided pooling caching int8 window argmax, "loop" = reference nested loops
+        if engine not in ("argmax", "loop"):
+            raise ValueError(f"Unknown pooling engine: {engine}")
+        if engine == "argmax" and pool_size * pool_size > np.iinfo(np.int8).max:
+            raise ValueError("argmax pooling engine supports windows of at most 127 elements")
+        self.engine = engine
+
     def forward(self, input_data):
+        if self.engine == "argmax":
+            return self._forward_argmax(input_data)
+        return self._forward_loop(input_data)
+
+    def backward(self, d_out):
+        if self.engine == "argmax":
+            return self._backward_argmax(d_out)
+        return self._backward_loop(d_out)
+
+    def _forward_argmax(self, input_data):
+        self.input_shape = input_data.shape
+        self.input_dtype = input_data.dtype
+        pooled_output, self.argmax = max_pool_argmax(input_data, self.pool_size, self.stride)
+        return pooled_output
+
+    def _backward_argmax(self, d_out):
+        return max_unpool_argmax(d_out, self.argmax, self.input_shape, self.input_dtype, self.pool_size, self.stride)
+
+    def _forward_loop(self, input_data):
         self.input = input_data
         self.max_indices = np.zeros_like(input_data, dtype=bool)  # same shape as input
         batch_size, channels, input_height, input_width = input_data.shape
@@ -124,7 +260,7 @@ class MaxPoolingLayer:
                         self.max_indices[n, c, vert_start:vert_end, horiz_start:horiz_end] = (current_patch == max_val)
         return pooled_output
     
-    def backward(self, d_out):
+    def _backward_loop(self, d_out):
         d_input = np.zeros_like(self.input)
         batch, ch, h, w = self.input.shape
         out_h = d_out.shape[2]
@@ -141,6 +277,8 @@ class MaxPoolingLayer:
         return d_input
     
 class DenseLayer:
+    trainable = (("weights", "dweights"), ("biases", "dbiases"))
+
     def __init__(self, input_size, output_size):
         self.weights = np.random.randn(input_size, output_size) * 0.01
         self.biases = np.zeros((1, output_size))
@@ -157,6 +295,95 @@ class DenseLayer:
         return np.dot(d_out, self.weights.T)
 
 
+class ConvReLUPoolBlock(ConvolutionalLayer):
+    """
+    Conv -> ReLU -> MaxPool in one layer (same numbers as the three separate layers).
+    The conv output is rectified in place and pooled straight away; between forward and
+    backward only the block input, the int8 pool argmax and the ReLU sign of each pooled
+    value are kept. The patch matrix is rebuilt from the input in backward instead of cached.
+    """
+    def __init__(self, input_shape, filter_size, number_of_filters, stride=1, padding=1, pool_size=2, pool_stride=2):
+        super().__init__(input_shape, filter_size, number_of_filters, stride, padding, engine="im2col")
+        if pool_size * pool_size > np.iinfo(np.int8).max:
+            raise ValueError("pool window must have at most 127 elements")
+        self.pool_size = pool_size
+        self.pool_stride = pool_stride
+        self.pooled_height = (self.output_height - pool_size)//pool_stride + 1
+        self.pooled_width = (self.output_width - pool_size)//pool_stride + 1
+        self.output_shape = (number_of_filters, self.pooled_height, self.pooled_width)
+
+    def forward(self, input_data):
+        self.input_data = input_data
+        batch_size = input_data.shape[0]
+        weights = self.filters.reshape(self.number_of_filters, -1)
+
+        conv_output = self._im2col(self._pad(input_data)) @ weights.T
+        conv_output += self.biases
+        np.maximum(conv_output, 0, out=conv_output)  # ReLU in place
+        conv_output = conv_output.reshape(
+            batch_size, self.output_height, self.output_width, self.number_of_filters
+        ).transpose(0, 3, 1, 2)
+
+        pooled_output, self.argmax = max_pool_argmax(conv_output, self.pool_size, self.pool_stride)
+        self.conv_dtype = conv_output.dtype
+        # A pooled value is > 0 exactly when the winning pre-ReLU activation was > 0
+        self.relu_mask = pooled_output > 0
+        return np.ascontiguousarray(pooled_output)
+
+    def backward(self, d_out):
+        batch_size = d_out.shape[0]
+        conv_shape = (batch_size, self.number_of_filters, self.output_height, self.output_width)
+        d_conv = max_unpool_argmax(d_out * self.relu_mask, self.argmax, conv_shape, self.conv_dtype,
+                                   self.pool_size, self.pool_stride)
+
+        input_padded = self._pad(self.input_data)
+        return self._backward_cols(d_conv, self._im2col(input_padded), input_padded.shape)
+
+
+class FlattenLayer:
+    def forward(self, input_data):
+        self.input_shape = input_data.shape
+        return input_data.reshape(input_data.shape[0], -1)
+
+    def backward(self, d_out):
+        return d_out.reshape(self.input_shape)
+
+
+class Sequential:
+    """Runs layers in order for forward and in reverse for backward."""
+    def __init__(self, layers):
+        self.layers = list(layers)
+
+    def forward(self, x):
+        for layer in self.layers:
+            x = layer.forward(x)
+        return x
+
+    def backward(self, d_out):
+        for layer in reversed(self.layers):
+            d_out = layer.backward(d_out)
+        return d_out
+
+    def parameters(self):
+        """[(name, layer, param_attr, grad_attr)] for every trainable array, e.g. name "0.filters"."""
+        params = []
+        for i, layer in enumerate(self.layers):
+            for param_attr, grad_attr in getattr(layer, "trainable", ()):
+                params.append((f"{i}.{param_attr}", layer, param_attr, grad_attr))
+        return params
+
+    def state_dict(self):
+        return {name: getattr(layer, attr) for name, layer, attr, _ in self.parameters()}
+
+    def load_state_dict(self, state):
+        # Copy into the existing arrays so optimizers holding references stay valid
+        for name, layer, attr, _ in self.parameters():
+            param = getattr(layer, attr)
+            if param.shape != state[name].shape:
+                raise ValueError(f"Shape mismatch for {name}: {param.shape} vs {state[name].shape}")
+            param[...] = state[name]
+
+
 def softmax_cross_entropy_loss(logits, labels):
     # logits: (batch_size, num_classes), labels: (batch_size,)
     labels = labels.astype(int)
@@ -193,8 +420,10 @@ def load_data(data_dir, image_size=(48,48)):
     y = np.array(y)  # shape (N,)
     return X, y
 
-train_X, train_y = load_data("C:/Users/HP/OneDrive/Desktop/projectWorks/6MoodImage/moodcnnProgram/model/train")
-test_X, test_y = load_data("C:/Users/HP/OneDrive/Desktop/projectWorks/6MoodImage/moodcnnProgram/model/test")
+# Decoding every JPEG on each run is slow; for training prefer compiling the folders
+# once with dataset.compile_dataset and opening them with dataset.open_dataset:
+#   python dataset.py train cache/train
+#   train_X, train_y, class_to_idx = open_dataset("cache/train")
 
 
 def augment_image(img):
@@ -222,13 +451,10 @@ def augment_image(img):
     return img_array[np.newaxis, :, :]  # back to (1,48,48)
 
 
+_batch_augmenter = BatchAugmenter()
+
+
 def augment_batch(X_batch, y_batch):
-    """Apply augmentation to each image in a batch."""
-    X_aug = []
-    for i in range(len(X_batch)):
-        if random.random() < 0.7:  # 70% chance to augment
-            X_aug.append(augment_image(X_batch[i]))
-        else:
-            X_aug.append(X_batch[i])  # keep original
-    return np.array(X_aug), y_batch
+    """Apply augmentation to a whole batch in one NumPy pass (same recipe as augment_image)."""
+    return _batch_augmenter(X_batch, y_batch)
 
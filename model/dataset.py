@@ -0,0 +1,150 @@
+import os
+import json
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+
+IMAGES_FILE = "images.npy"
+LABELS_FILE = "labels.npy"
+MANIFEST_FILE = "class_map.json"
+
+
+def compile_dataset(data_dir, cache_dir, image_size=(48,48)):
+    """
+    One-time pass over an ImageFolder-style directory (one sub-folder per class).
+    Writes the resized grayscale images as a uint8 (N, 1, H, W) .npy, the labels,
+    and a class-map manifest into cache_dir. Returns the number of images written.
+    """
+    classes = sorted(d for d in os.listdir(data_dir) if os.path.isdir(os.path.join(data_dir, d)))
+    label_map = {label: i for i, label in enumerate(classes)}
+
+    files = []
+    for label in classes:
+        folder = os.path.join(data_dir, label)
+        for img_file in sorted(os.listdir(folder)):
+            files.append((os.path.join(folder, img_file), label_map[label]))
+
+    os.makedirs(cache_dir, exist_ok=True)
+    width, height = image_size
+
+    # Written straight into a memmap, so the decoded dataset never sits in RAM at once
+    images = np.lib.format.open_memmap(
+        os.path.join(cache_dir, IMAGES_FILE), mode="w+", dtype=np.uint8, shape=(len(files), 1, height, width)
+    )
+    labels = np.empty(len(files), dtype=np.uint8)
+    for i, (img_path, label) in enumerate(files):
+        with Image.open(img_path) as img:
+            images[i, 0] = np.asarray(img.convert('L').resize(image_size), dtype=np.uint8)
+        labels[i] = label
+    images.flush()
+    del images
+
+    np.save(os.path.join(cache_dir, LABELS_FILE), labels)
+    with open(os.path.join(cache_dir, MANIFEST_FILE), "w") as f:
+        json.dump({"class_to_idx": label_map, "image_size": [height, width], "count": len(files)}, f, indent=2)
+    return len(files)
+
+
+def open_dataset(cache_dir):
+    """
+    Open a compiled dataset without reading it: images come back as a read-only
+    uint8 memmap of shape (N, 1, H, W), labels as int64, plus the class_to_idx map.
+    """
+    images = np.load(os.path.join(cache_dir, IMAGES_FILE), mmap_mode='r')
+    labels = np.load(os.path.join(cache_dir, LABELS_FILE)).astype(np.int64)
+    with open(os.path.join(cache_dir, MANIFEST_FILE)) as f:
+        class_to_idx = json.load(f)["class_to_idx"]
+    return images, labels, class_to_idx
+
+
+def normalize_batch(images):
+    """uint8 batch (any shape) -> float32 in [0, 1], only for the rows actually used."""
+    return np.asarray(images, dtype=np.float32) / 255.0
+
+
+class BatchLoader:
+    """
+    Mini-batch iterator over (images, labels) that never materializes the dataset.
+    images can be the uint8 memmap from open_dataset or any (N, 1, H, W) array.
+    Each pass over the loader is one epoch with freshly shuffled indices. Batches are
+    sliced, normalized and augmented on background threads; at most `prefetch`
+    batches are in flight, so memory is bounded by queue depth, not dataset size.
+    An augment with `takes_rng = True` (augment.BatchAugmenter) is called with a Generator
+    seeded per batch from this loader's RNG, so augmentation is fixed by the epoch's
+    starting RNG state alone, whatever has been prefetched.
+    """
+    def __init__(self, images, labels, batch_size=32, shuffle=True, augment=None,
+                 prefetch=4, num_workers=2, drop_last=False, seed=None):
+        self.images = images
+        self.labels = np.asarray(labels)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.augment = augment  # optional callable (X_batch, y_batch[, rng]) -> (X_batch, y_batch)
+        self.prefetch = max(1, prefetch)
+        self.num_workers = max(1, num_workers)
+        self.drop_last = drop_last
+        self.rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.labels) // self.batch_size
+        return -(-len(self.labels) // self.batch_size)
+
+    def _load_batch(self, idx, seed=None):
+        # Sorted reads keep memmap access mostly sequential; the permutation restores the shuffle
+        order = np.argsort(idx)
+        X = np.empty((len(idx),) + self.images.shape[1:], dtype=np.float32)
+        X[order] = normalize_batch(self.images[idx[order]])
+        y = self.labels[idx]
+        if seed is not None:
+            X, y = self.augment(X, y, rng=np.random.default_rng(seed))
+        elif self.augment is not None:
+            X, y = self.augment(X, y)
+        return X, y
+
+    def __iter__(self):
+        return self.epoch()
+
+    def epoch(self, start_batch=0):
+        """
+        One epoch of batches. start_batch skips the first batches of the shuffled order
+        without loading them (used to resume training mid-epoch).
+        """
+        n = len(self.labels)
+        indices = self.rng.permutation(n) if self.shuffle else np.arange(n)
+        batches = [indices[i:i + self.batch_size] for i in range(0, n, self.batch_size)]
+        if self.drop_last and batches and len(batches[-1]) < self.batch_size:
+            batches.pop()
+        # One augmentation seed per batch, drawn right after the permutation
+        seeds = [None] * len(batches)
+        if getattr(self.augment, "takes_rng", False):
+            seeds = self.rng.integers(0, 2**63, size=len(batches)).tolist()
+        batches = list(zip(batches, seeds))[start_batch:]
+
+        executor = ThreadPoolExecutor(max_workers=self.num_workers)
+        pending = deque()
+        try:
+            for idx, seed in batches:
+                pending.append(executor.submit(self._load_batch, idx, seed))
+                if len(pending) >= self.prefetch:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            # Consumer stopped early (break / exception): drop whatever is still queued
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile an image folder into a memory-mappable .npy cache")
+    parser.add_argument("data_dir", help="folder with one sub-folder per class, e.g. model/train")
+    parser.add_argument("cache_dir", help="output folder for images.npy, labels.npy and class_map.json")
+    parser.add_argument("--size", type=int, default=48, help="square output size in pixels")
+    args = parser.parse_args()
+
+    count = compile_dataset(args.data_dir, args.cache_dir, image_size=(args.size, args.size))
+    print(f"Wrote {count} images to {args.cache_dir}")
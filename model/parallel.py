@@ -0,0 +1,169 @@
+import os
+import argparse
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+
+from cnn_layers import softmax_cross_entropy_loss
+from dataset import BatchLoader, open_dataset
+from augment import BatchAugmenter
+import train as training
+
+
+class DataParallelTrainer:
+    """
+    Splits every mini-batch across a pool of worker processes.
+
+    The model's weights are moved into one shared-memory block: the optimizer keeps
+    updating them in place in the parent and workers read the same pages, so weights
+    are never pickled. Each worker writes its shard's gradients into its own row of a
+    shared gradient block; the parent sums the rows in shard order and then runs the
+    normal optimizer step. Shard losses are rescaled by shard_size / batch_size, so the
+    summed gradient is the full-batch mean gradient and training matches train.train_step
+    up to floating-point summation order.
+
+    model_factory(**factory_kwargs) must build the same architecture as `model` and be
+    importable by the workers (e.g. train.build_mood_cnn).
+    """
+    def __init__(self, model, model_factory, factory_kwargs=None, num_workers=None):
+        self.model = model
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.params = model.parameters()
+
+        # Flat layout shared by parent and workers: name -> (offset, shape)
+        self.layout, offset = [], 0
+        for name, layer, attr, _ in self.params:
+            value = getattr(layer, attr)
+            self.layout.append((name, offset, value.shape))
+            offset += value.size
+        self.size = offset
+        dtype = np.result_type(*[getattr(layer, attr) for _, layer, attr, _ in self.params])
+        self.dtype = np.dtype(dtype)
+
+        self.param_shm = shared_memory.SharedMemory(create=True, size=max(self.size * self.dtype.itemsize, 1))
+        self.grad_shm = shared_memory.SharedMemory(
+            create=True, size=max(self.num_workers * self.size * self.dtype.itemsize, 1)
+        )
+        flat_params = np.ndarray((self.size,), dtype=self.dtype, buffer=self.param_shm.buf)
+        self.grad_block = np.ndarray((self.num_workers, self.size), dtype=self.dtype, buffer=self.grad_shm.buf)
+        self.grad_sum = np.zeros(self.size, dtype=self.dtype)
+
+        # Re-home the parent's parameters onto shared memory and point gradients at grad_sum
+        for (name, layer, attr, grad_attr), (_, off, shape) in zip(self.params, self.layout):
+            count = int(np.prod(shape))
+            view = flat_params[off:off + count].reshape(shape)
+            view[...] = getattr(layer, attr)
+            setattr(layer, attr, view)
+            setattr(layer, grad_attr, self.grad_sum[off:off + count].reshape(shape))
+
+        self.pool = mp.get_context().Pool(
+            self.num_workers, initializer=_init_worker,
+            initargs=(model_factory, factory_kwargs or {}, self.param_shm.name, self.grad_shm.name,
+                      self.layout, self.size, self.dtype.str, self.num_workers),
+        )
+
+    def step(self, model, optimizer, X, y):
+        """Drop-in replacement for train.train_step; pass as train.train(..., step_fn=trainer.step)."""
+        shards = [s for s in np.array_split(np.arange(len(y)), self.num_workers) if len(s)]
+        tasks = [(slot, X[idx], y[idx], len(y)) for slot, idx in enumerate(shards)]
+        results = self.pool.map(_worker_step, tasks)
+
+        # Fixed shard order keeps the sum (and therefore training) deterministic
+        np.sum(self.grad_block[:len(shards)], axis=0, out=self.grad_sum)
+        optimizer.step()
+        loss = sum(r[0] for r in results)
+        correct = sum(r[1] for r in results)
+        return loss, correct
+
+    def close(self):
+        """Stop the workers and give the model private copies of its weights again."""
+        if self.pool is None:
+            return
+        self.pool.close()
+        self.pool.join()
+        self.pool = None
+        for name, layer, attr, grad_attr in self.params:
+            setattr(layer, attr, np.array(getattr(layer, attr)))
+            setattr(layer, grad_attr, np.array(getattr(layer, grad_attr)))
+        self.grad_block = None
+        for shm in (self.param_shm, self.grad_shm):
+            shm.close()
+            shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# ===================== Worker side =====================
+
+_worker = {}
+
+
+def _init_worker(model_factory, factory_kwargs, param_name, grad_name, layout, size, dtype, num_workers):
+    model = model_factory(**factory_kwargs)
+    param_shm = shared_memory.SharedMemory(name=param_name)
+    grad_shm = shared_memory.SharedMemory(name=grad_name)
+    flat_params = np.ndarray((size,), dtype=dtype, buffer=param_shm.buf)
+    grad_block = np.ndarray((num_workers, size), dtype=dtype, buffer=grad_shm.buf)
+
+    # Workers read weights straight from the parent's shared block
+    params = model.parameters()
+    for (name, layer, attr, grad_attr), (_, off, shape) in zip(params, layout):
+        setattr(layer, attr, flat_params[off:off + int(np.prod(shape))].reshape(shape))
+
+    _worker.update(model=model, params=params, layout=layout, grad_block=grad_block,
+                   shm=(param_shm, grad_shm))  # keep the mappings alive
+
+
+def _worker_step(task):
+    slot, X, y, batch_size = task
+    model = _worker["model"]
+    logits = model.forward(X)
+    loss, grad = softmax_cross_entropy_loss(logits, y)
+    scale = len(y) / batch_size  # shard mean -> contribution to the full-batch mean
+    model.backward(grad * scale)
+
+    row = _worker["grad_block"][slot]
+    for (name, layer, attr, grad_attr), (_, off, shape) in zip(_worker["params"], _worker["layout"]):
+        g = getattr(layer, grad_attr)
+        row[off:off + g.size] = g.ravel()
+    return loss * scale, int(np.sum(np.argmax(logits, axis=1) == y))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Data-parallel training of the NumPy MoodCNN")
+    parser.add_argument("train_cache")
+    parser.add_argument("--val-cache")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=128)
+    parser.add_argument("--optimizer", choices=sorted(training.OPTIMIZERS), default="adam")
+    parser.add_argument("--lr", type=float, default=1e-3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--checkpoint", default="mood_numpy.npz")
+    parser.add_argument("--checkpoint-every", type=int, default=200)
+    parser.add_argument("--resume", action="store_true")
+    parser.add_argument("--fused", action="store_true", help="use fused Conv+ReLU+MaxPool blocks")
+    args = parser.parse_args()
+
+    np.random.seed(args.seed)
+    train_X, train_y, class_to_idx = open_dataset(args.train_cache)
+    val_data = open_dataset(args.val_cache)[:2] if args.val_cache else None
+
+    factory_kwargs = {"num_classes": len(class_to_idx), "fused": args.fused}
+    model = training.build_mood_cnn(**factory_kwargs)
+    optimizer = training.OPTIMIZERS[args.optimizer](model.parameters(), lr=args.lr)
+    loader = BatchLoader(train_X, train_y, batch_size=args.batch_size, augment=BatchAugmenter(seed=args.seed),
+                         num_workers=1, seed=args.seed)
+
+    with DataParallelTrainer(model, training.build_mood_cnn, factory_kwargs, num_workers=args.workers) as trainer:
+        start_epoch, start_step = 0, 0
+        if args.resume and os.path.exists(args.checkpoint):
+            start_epoch, start_step = training.load_checkpoint(args.checkpoint, model, optimizer, loader)
+            print(f"Resuming from epoch {start_epoch + 1}, step {start_step}")
+        training.train(model, optimizer, loader, args.epochs, val_data=val_data, checkpoint_path=args.checkpoint,
+                       checkpoint_every=args.checkpoint_every, start_epoch=start_epoch, start_step=start_step,
+                       step_fn=trainer.step)
@@ -0,0 +1,18 @@
+import unittest
+
+import benchmark
+
+
+class ReferenceCheckTests(unittest.TestCase):
+    def test_every_optimized_path_matches_its_loop_reference(self):
+        checked = []
+        for name, make_layer, shape, reference in benchmark.mood_cnn_cases():
+            if reference is None:
+                continue
+            self.assertLess(benchmark.check_against_reference(make_layer, shape, reference), 1e-8, name)
+            checked.append(name)
+        self.assertTrue(any(name.startswith("block") for name in checked))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+import unittest
+import numpy as np
+
+from augment import BatchAugmenter
+from dataset import BatchLoader
+from parallel import DataParallelTrainer
+import train as training
+
+
+class DataParallelTests(unittest.TestCase):
+    """Data-parallel training matches single-process training for a fixed seed."""
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.images = rng.integers(0, 256, (24, 1, 48, 48), dtype=np.uint8)
+        self.labels = rng.integers(0, 5, 24)
+
+    def make_run(self):
+        np.random.seed(0)  # layer weight init
+        model = training.build_mood_cnn(num_classes=5)
+        optimizer = training.Adam(model.parameters(), lr=1e-3)
+        loader = BatchLoader(self.images, self.labels, batch_size=8, augment=BatchAugmenter(seed=0), seed=0)
+        return model, optimizer, loader
+
+    def test_matches_single_process_training(self):
+        model, optimizer, loader = self.make_run()
+        training.train(model, optimizer, loader, epochs=2, log_every=0, step_fn=training.train_step)
+        expected = model.state_dict()
+
+        model, optimizer, loader = self.make_run()
+        with DataParallelTrainer(model, training.build_mood_cnn, {"num_classes": 5}, num_workers=3) as trainer:
+            training.train(model, optimizer, loader, epochs=2, log_every=0, step_fn=trainer.step)
+
+        for name, value in expected.items():
+            # Only the order the shard gradients are summed in differs
+            np.testing.assert_allclose(model.state_dict()[name], value, rtol=0, atol=1e-10, err_msg=name)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+
+from augment import BatchAugmenter
+from dataset import BatchLoader
+import train as training
+
+
+class Interrupted(Exception):
+    pass
+
+
+class ResumeTests(unittest.TestCase):
+    """A run interrupted mid-epoch and resumed from its checkpoint ends with the same weights."""
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.images = rng.integers(0, 256, (40, 1, 48, 48), dtype=np.uint8)
+        self.labels = rng.integers(0, 5, 40)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.checkpoint = os.path.join(tmp.name, "ckpt.npz")
+
+    def make_run(self, num_workers):
+        np.random.seed(0)  # layer weight init
+        model = training.build_mood_cnn(num_classes=5)
+        optimizer = training.Adam(model.parameters(), lr=1e-3)
+        loader = BatchLoader(self.images, self.labels, batch_size=8, augment=BatchAugmenter(seed=0),
+                             prefetch=4, num_workers=num_workers, seed=0)
+        return model, optimizer, loader
+
+    def check_resume(self, num_workers):
+        model, optimizer, loader = self.make_run(num_workers)
+        training.train(model, optimizer, loader, epochs=2, log_every=0)
+        expected = model.state_dict()
+
+        model, optimizer, loader = self.make_run(num_workers)
+        steps = []
+
+        def interrupting_step(*args):
+            if len(steps) == 7:  # epoch 2, batch 3; the checkpoint is at epoch 2, step 2
+                raise Interrupted
+            steps.append(None)
+            return training.train_step(*args)
+
+        with self.assertRaises(Interrupted):
+            training.train(model, optimizer, loader, epochs=2, checkpoint_path=self.checkpoint,
+                           checkpoint_every=2, log_every=0, step_fn=interrupting_step)
+
+        model, optimizer, loader = self.make_run(num_workers)
+        start_epoch, start_step = training.load_checkpoint(self.checkpoint, model, optimizer, loader)
+        self.assertEqual((start_epoch, start_step), (1, 2))
+        training.train(model, optimizer, loader, epochs=2, start_epoch=start_epoch, start_step=start_step,
+                       log_every=0)
+
+        for name, value in expected.items():
+            np.testing.assert_array_equal(model.state_dict()[name], value, err_msg=name)
+
+    def test_resume_matches_uninterrupted_run(self):
+        self.check_resume(num_workers=1)
+
+    def test_resume_matches_with_parallel_loading(self):
+        self.check_resume(num_workers=2)
+
+
+if __name__ == "__main__":
+    unittest.main()
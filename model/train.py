@@ -0,0 +1,241 @@
+import os
+import json
+import time
+import argparse
+import numpy as np
+
+from cnn_layers import (ConvolutionalLayer, ReLULayer, MaxPoolingLayer, DenseLayer, FlattenLayer,
+                        ConvReLUPoolBlock, Sequential, softmax_cross_entropy_loss)
+from dataset import BatchLoader, open_dataset
+from augment import BatchAugmenter
+
+
+def build_mood_cnn(num_classes=5, input_size=48, fused=False):
+    """
+    NumPy twin of api/mood_model.MoodCNN: 4x (Conv3x3 -> ReLU -> MaxPool2) then 1152 -> 128 -> classes.
+    fused=True uses ConvReLUPoolBlock for each repeat (same parameters, about half the activation memory).
+    """
+    layers = []
+    channels, size = 1, input_size
+    for filters in (16, 32, 64, 128):
+        if fused:
+            layers.append(ConvReLUPoolBlock((channels, size, size), filter_size=3, number_of_filters=filters, padding=1))
+        else:
+            layers += [ConvolutionalLayer((channels, size, size), filter_size=3, number_of_filters=filters, padding=1),
+                       ReLULayer(),
+                       MaxPoolingLayer(pool_size=2, stride=2)]
+        channels, size = filters, size // 2
+    layers += [FlattenLayer(),
+               DenseLayer(channels * size * size, 128),
+               ReLULayer(),
+               DenseLayer(128, num_classes)]
+    return Sequential(layers)
+
+
+# ===================== Optimizers =====================
+# Both update the parameters in place and keep all their state in buffers allocated
+# once up front, so a training step allocates nothing on the update side.
+
+class SGD:
+    def __init__(self, parameters, lr=0.01, momentum=0.9):
+        self.parameters = parameters  # from Sequential.parameters()
+        self.lr = lr
+        self.momentum = momentum
+        self.velocity = {name: np.zeros_like(getattr(layer, attr)) for name, layer, attr, _ in parameters}
+        self.scratch = {name: np.zeros_like(getattr(layer, attr)) for name, layer, attr, _ in parameters}
+
+    def step(self):
+        for name, layer, attr, grad_attr in self.parameters:
+            param, grad = getattr(layer, attr), getattr(layer, grad_attr)
+            v, s = self.velocity[name], self.scratch[name]
+            v *= self.momentum
+            v += grad
+            np.multiply(v, self.lr, out=s)
+            param -= s
+
+    def state_dict(self):
+        return {f"velocity/{name}": v for name, v in self.velocity.items()}
+
+    def load_state_dict(self, state):
+        for name, v in self.velocity.items():
+            v[...] = state[f"velocity/{name}"]
+
+
+class Adam:
+    def __init__(self, parameters, lr=1e-3, beta1=0.9, beta2=0.999, eps=1e-8):
+        self.parameters = parameters
+        self.lr = lr
+        self.beta1 = beta1
+        self.beta2 = beta2
+        self.eps = eps
+        self.t = 0
+        self.m = {name: np.zeros_like(getattr(layer, attr)) for name, layer, attr, _ in parameters}
+        self.v = {name: np.zeros_like(getattr(layer, attr)) for name, layer, attr, _ in parameters}
+        self.scratch = {name: np.zeros_like(getattr(layer, attr)) for name, layer, attr, _ in parameters}
+
+    def step(self):
+        self.t += 1
+        # Bias correction folded into the step size
+        lr_t = self.lr * np.sqrt(1 - self.beta2 ** self.t) / (1 - self.beta1 ** self.t)
+        for name, layer, attr, grad_attr in self.parameters:
+            param, grad = getattr(layer, attr), getattr(layer, grad_attr)
+            m, v, s = self.m[name], self.v[name], self.scratch[name]
+
+            m *= self.beta1
+            np.multiply(grad, 1 - self.beta1, out=s)
+            m += s
+
+            v *= self.beta2
+            np.square(grad, out=s)
+            s *= 1 - self.beta2
+            v += s
+
+            np.sqrt(v, out=s)
+            s += self.eps
+            np.divide(m, s, out=s)
+            s *= lr_t
+            param -= s
+
+    def state_dict(self):
+        state = {"t": np.array(self.t)}
+        state.update({f"m/{name}": m for name, m in self.m.items()})
+        state.update({f"v/{name}": v for name, v in self.v.items()})
+        return state
+
+    def load_state_dict(self, state):
+        self.t = int(state["t"])
+        for name in self.m:
+            self.m[name][...] = state[f"m/{name}"]
+            self.v[name][...] = state[f"v/{name}"]
+
+
+OPTIMIZERS = {"sgd": SGD, "adam": Adam}
+
+
+# ===================== Checkpoints =====================
+
+def save_checkpoint(path, model, optimizer, epoch, step, epoch_rng_state=None):
+    """
+    Save weights, optimizer buffers and the position in training to a single .npz.
+    epoch/step is where training continues: `step` batches of `epoch` are already done.
+    epoch_rng_state is the loader's RNG state at the start of that epoch; it fixes both
+    the shuffle order and each batch's augmentation seed, so resuming replays them.
+    """
+    arrays = {f"param/{name}": value for name, value in model.state_dict().items()}
+    arrays.update({f"optim/{key}": value for key, value in optimizer.state_dict().items()})
+    arrays["meta/epoch"] = np.array(epoch)
+    arrays["meta/step"] = np.array(step)
+    arrays["meta/optimizer"] = np.array(type(optimizer).__name__)
+    if epoch_rng_state is not None:
+        arrays["meta/loader_rng"] = np.array(json.dumps(epoch_rng_state))
+
+    # Write next to the target and rename, so an interrupted save never corrupts the last checkpoint
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path, model, optimizer=None, loader=None):
+    """Restore a checkpoint in place. Returns (epoch, step) to pass to train()."""
+    with np.load(path, allow_pickle=False) as data:
+        model.load_state_dict({key[len("param/"):]: data[key] for key in data.files if key.startswith("param/")})
+        if optimizer is not None:
+            saved = str(data["meta/optimizer"])
+            if saved != type(optimizer).__name__:
+                raise ValueError(f"Checkpoint was saved with {saved}, not {type(optimizer).__name__}")
+            optimizer.load_state_dict({key[len("optim/"):]: data[key] for key in data.files if key.startswith("optim/")})
+        if loader is not None and "meta/loader_rng" in data.files:
+            loader.rng.bit_generator.state = json.loads(str(data["meta/loader_rng"]))
+        return int(data["meta/epoch"]), int(data["meta/step"])
+
+
+# ===================== Training =====================
+
+def evaluate(model, images, labels, batch_size=256):
+    """Mean loss and accuracy over a whole split, in order, without augmentation."""
+    total_loss, correct = 0.0, 0
+    for X, y in BatchLoader(images, labels, batch_size=batch_size, shuffle=False):
+        logits = model.forward(X)
+        loss, _ = softmax_cross_entropy_loss(logits, y)
+        total_loss += loss * len(y)
+        correct += int(np.sum(np.argmax(logits, axis=1) == y))
+    return total_loss / len(labels), correct / len(labels)
+
+
+def train_step(model, optimizer, X, y):
+    logits = model.forward(X)
+    loss, grad = softmax_cross_entropy_loss(logits, y)
+    model.backward(grad)
+    optimizer.step()
+    return loss, int(np.sum(np.argmax(logits, axis=1) == y))
+
+
+def train(model, optimizer, loader, epochs, val_data=None, checkpoint_path=None, checkpoint_every=200,
+          start_epoch=0, start_step=0, log_every=50, step_fn=train_step):
+    """
+    Train for `epochs` epochs, continuing from (start_epoch, start_step) as returned by
+    load_checkpoint. Saves a checkpoint every `checkpoint_every` batches and at each epoch end.
+    step_fn(model, optimizer, X, y) -> (loss, correct) runs one update (see parallel.py).
+    """
+    history = []
+    for epoch in range(start_epoch, epochs):
+        epoch_rng_state = loader.rng.bit_generator.state
+        first_step = start_step if epoch == start_epoch else 0
+        total_loss, correct, seen = 0.0, 0, 0
+        start = time.time()
+
+        for step, (X, y) in enumerate(loader.epoch(first_step), start=first_step):
+            loss, batch_correct = step_fn(model, optimizer, X, y)
+            total_loss += loss * len(y)
+            correct += batch_correct
+            seen += len(y)
+
+            if log_every and (step + 1) % log_every == 0:
+                print(f"epoch {epoch + 1} step {step + 1}/{len(loader)} loss {total_loss / seen:.4f} acc {correct / seen:.4f}")
+            if checkpoint_path and checkpoint_every and (step + 1) % checkpoint_every == 0:
+                save_checkpoint(checkpoint_path, model, optimizer, epoch, step + 1, epoch_rng_state)
+
+        record = {"epoch": epoch + 1, "loss": total_loss / max(seen, 1), "acc": correct / max(seen, 1),
+                  "seconds": time.time() - start}
+        if val_data is not None:
+            record["val_loss"], record["val_acc"] = evaluate(model, *val_data)
+        history.append(record)
+        print(record)
+
+        if checkpoint_path:
+            save_checkpoint(checkpoint_path, model, optimizer, epoch + 1, 0, loader.rng.bit_generator.state)
+    return history
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the NumPy MoodCNN on a compiled dataset cache (see dataset.py)")
+    parser.add_argument("train_cache")
+    parser.add_argument("--val-cache")
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--optimizer", choices=sorted(OPTIMIZERS), default="adam")
+    parser.add_argument("--lr", type=float, default=1e-3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--checkpoint", default="mood_numpy.npz")
+    parser.add_argument("--checkpoint-every", type=int, default=200)
+    parser.add_argument("--resume", action="store_true", help="continue from --checkpoint if it exists")
+    parser.add_argument("--fused", action="store_true", help="use fused Conv+ReLU+MaxPool blocks")
+    args = parser.parse_args()
+
+    np.random.seed(args.seed)  # layer weight init
+    train_X, train_y, class_to_idx = open_dataset(args.train_cache)
+    val_data = open_dataset(args.val_cache)[:2] if args.val_cache else None
+
+    model = build_mood_cnn(num_classes=len(class_to_idx), fused=args.fused)
+    optimizer = OPTIMIZERS[args.optimizer](model.parameters(), lr=args.lr)
+    loader = BatchLoader(train_X, train_y, batch_size=args.batch_size, augment=BatchAugmenter(seed=args.seed),
+                         num_workers=1, seed=args.seed)
+
+    start_epoch, start_step = 0, 0
+    if args.resume and os.path.exists(args.checkpoint):
+        start_epoch, start_step = load_checkpoint(args.checkpoint, model, optimizer, loader)
+        print(f"Resuming from epoch {start_epoch + 1}, step {start_step}")
+
+    train(model, optimizer, loader, args.epochs, val_data=val_data, checkpoint_path=args.checkpoint,
+          checkpoint_every=args.checkpoint_every, start_epoch=start_epoch, start_step=start_step)